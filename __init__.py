@@ -15,7 +15,7 @@ from . import operators, panels, preferences
 
 def register():
     # Register preferences first
-    bpy.utils.register_class(preferences.AICodePreferences)
+    preferences.register()
     
     # Register operators
     operators.register()
@@ -27,7 +27,7 @@ def unregister():
     # Unregister in reverse order
     panels.unregister()
     operators.unregister()
-    bpy.utils.unregister_class(preferences.AICodePreferences)
+    preferences.unregister()
 
 if __name__ == "__main__":
     register()
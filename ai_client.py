@@ -3,19 +3,434 @@ import requests
 import json
 import time
 import base64
+import gzip
+import hashlib
+import io
 import os
+import random
+import re
+import asyncio
+import types
+import threading
+import struct
 import tempfile
-from mathutils import Vector
-from bpy.props import StringProperty
+import zlib
+import numpy as np
+from collections import Counter, OrderedDict, deque
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bpy.app.handlers import persistent
+from .cache import ResponseCache
+from .preferences import get_addon_preferences, get_pref
+
+# orjson is much faster on multi-megabyte payloads (base64 screenshots) but isn't bundled with Blender
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pybase64 uses SIMD kernels and is several times faster on screenshot-sized inputs
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# Pillow enables JPEG screenshots; without it captures are sent as PNG
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 class AIBackendError(Exception):
     pass
 
+# Separates the scene context (stable between iterations) from the per-request part of a prompt
+PROMPT_REQUEST_MARKER = "USER REQUEST:\n"
+
+# Bounds on the in-memory response log so long sessions don't grow without limit
+RESPONSE_LOG_MAX_ENTRIES = 200
+RESPONSE_LOG_MAX_CHARS = 4096
+
+# Invariant parts of the generation prompt, built once instead of on every request
+PROMPT_PREFIX = """You are BlendAI, an expert Blender Python (bpy) code generator specialized in creating high-quality 3D content.
+You have deep knowledge of Blender's API, best practices, and 3D modeling workflows.
+
+CORE RULES:
+1. Generate ONLY clean, executable Python code using the Blender API (bpy)
+2. Include comprehensive error handling with try-except blocks
+3. Add clear, helpful comments explaining each step
+4. Ensure code is safe and won't crash Blender
+5. Use proper Blender conventions and best practices
+6. Do NOT include markdown, explanations, or anything except Python code
+7. Test for object existence before manipulating
+8. Use appropriate selection and active object management
+
+DETAILED SCENE CONTEXT:
+"""
+
+PROMPT_SUFFIX = """Generate Python code that fulfills this request. The code should:
+- Work with the current scene context
+- Be production-ready and efficient
+- Include error handling and validation
+- Follow Blender best practices
+- Return ONLY executable Python code
+"""
+
+PROMPT_SCREENSHOT_NOTE = "\n[VIEWPORT SCREENSHOT INCLUDED - Use this visual context to better understand the current scene]\n"
+
+def _dumps(data):
+    """Serialize a request body to JSON bytes"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            # orjson is stricter than json (e.g. non-str keys, ints past 64 bits); let json try
+            pass
+    # Like orjson, emit raw UTF-8: \uXXXX escapes make non-ASCII object names several times larger
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def _loads(content):
+    """Parse a JSON response body (bytes or str)"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _b64encode(data):
+    """Base64-encode bytes to an ASCII string"""
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(data).decode('ascii')
+
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    """tiktoken's o200k encoding, or None when tiktoken (not bundled with Blender) is unavailable"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # get_encoding also fails when the BPE file can't be downloaded on first use
+        print(f"Warning: tiktoken unavailable, falling back to approximate token counts: {e}")
+        return None
+
+# Token counts by text digest, so re-counting an unchanged prompt is a dict lookup
+TOKEN_COUNT_CACHE_SIZE = 1024
+
+# Built prompts kept for repeated requests against an unchanged scene
+PROMPT_CACHE_SIZE = 16
+
+def _encode_png(pixels):
+    """Encode an (height, width, 4) uint8 RGBA array as PNG bytes using only zlib"""
+    height, width, _ = pixels.shape
+    # Each scanline is prefixed with filter type 0 (None)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * 4)
+    
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        chunk(b"IHDR", header),
+        chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)),
+        chunk(b"IEND", b"")
+    ))
+
+def _encode_jpeg(pixels, quality=85):
+    """Encode an (height, width, 4) uint8 RGBA array as JPEG bytes (requires Pillow)"""
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(pixels[:, :, :3])).save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def _iter_sse_events(response):
+    """Yield the decoded JSON payload of each `data:` line in a server-sent event stream"""
+    # Lines stay bytes: both JSON decoders take UTF-8 directly, so there is no per-chunk decode step
+    for line in response.iter_lines():
+        if not line.startswith(b"data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == b"[DONE]":
+            break
+        try:
+            yield _loads(payload)
+        except ValueError:
+            print(f"Warning: Skipping malformed stream event: {payload[:80].decode('utf-8', 'replace')}")
+
+def _openai_delta(event):
+    """Text carried by an OpenAI-compatible chat.completion.chunk"""
+    if 'error' in event:
+        raise AIBackendError(f"API error: {event['error'].get('message', 'Unknown error')}")
+    choices = event.get('choices')
+    if choices:
+        return choices[0].get('delta', {}).get('content')
+    return None
+
+def _anthropic_delta(event):
+    """Text carried by an Anthropic content_block_delta event"""
+    if event.get('type') == 'error':
+        raise AIBackendError(f"Anthropic API error: {event['error'].get('message', 'Unknown error')}")
+    if event.get('type') == 'content_block_delta' and event['delta'].get('type') == 'text_delta':
+        return event['delta']['text']
+    return None
+
+def _gemini_delta(event):
+    """Text carried by one streamed Gemini GenerateContentResponse"""
+    if 'error' in event:
+        raise AIBackendError(f"Gemini API error: {event['error'].get('message', 'Unknown error')}")
+    candidates = event.get('candidates')
+    if candidates:
+        parts = candidates[0].get('content', {}).get('parts', [])
+        return "".join(part.get('text', '') for part in parts)
+    return None
+
+def _collect_stream(response, extract, on_delta):
+    """Feed each text delta of a streamed response to on_delta and return the full text"""
+    parts = []
+    for event in _iter_sse_events(response):
+        text = extract(event)
+        if text:
+            parts.append(text)
+            on_delta(text)
+    return "".join(parts)
+
+@lru_cache(maxsize=8)
+def _chat_completions_url(api_url):
+    """Local server URL with /chat/completions appended if missing"""
+    if api_url.endswith('/chat/completions'):
+        return api_url
+    return api_url + ('chat/completions' if api_url.endswith('/') else '/chat/completions')
+
+def _create_session():
+    """HTTP session shared by all backend calls so TCP/TLS connections are kept alive and reused"""
+    session = requests.Session()
+    session.headers['Connection'] = 'keep-alive'
+    # Every backend posts JSON; setting it here saves building the header on each call
+    session.headers['Content-Type'] = 'application/json'
+    # Transport level only: connection failures are retried here, HTTP status retries are
+    # handled by AIClient.post so they can honor the providers' rate-limit headers
+    retry = Retry(total=3, read=0, backoff_factor=0.3)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class ViewportShot:
+    """Viewport capture grabbed on the main thread; encoding is deferred so a worker can do it"""
+
+    def __init__(self, pixels=None, image_bytes=None, mime_type='image/png', quality=85):
+        if pixels is not None:
+            pixels = np.ascontiguousarray(pixels)
+        self.pixels = pixels
+        self.image_bytes = image_bytes
+        self.quality = quality
+        # JPEG is several times smaller than PNG for viewport captures, so it costs fewer image tokens
+        if pixels is not None:
+            mime_type = 'image/jpeg' if Image is not None else 'image/png'
+        self.mime_type = mime_type
+        # Content hash: lets a re-capture of an unchanged view reuse an earlier shot's encoding,
+        # and keys the response cache without encoding the image first
+        digest = hashlib.blake2b(f"{mime_type}|{quality}".encode('utf-8'), digest_size=16)
+        digest.update(memoryview(pixels if pixels is not None else image_bytes))
+        self.digest = digest.digest()
+        self._encoded = None
+        self._lock = threading.Lock()
+
+    def encode(self):
+        """Return the capture as a base64 string of type mime_type, encoding it on first call"""
+        with self._lock:
+            if self._encoded is None:
+                if self.image_bytes is None:
+                    if self.mime_type == 'image/jpeg':
+                        self.image_bytes = _encode_jpeg(self.pixels, self.quality)
+                    else:
+                        self.image_bytes = _encode_png(self.pixels)
+                    self.pixels = None
+                self._encoded = _b64encode(self.image_bytes)
+                self.image_bytes = None
+            return self._encoded
+
+# User-facing messages for failed requests, keyed by failure kind or HTTP status
+REQUEST_ERROR_MESSAGES = {
+    'timeout': "{provider} API request timed out. Please try again.",
+    'connection': "Failed to connect to {provider} API. Check your internet connection.",
+    401: "Invalid {provider} API key. Please check your API key in preferences.",
+    429: "{provider} API rate limit exceeded. Please wait and try again.",
+    400: "Invalid request to {provider} API. Check your model selection and parameters."
+}
+LOCAL_REQUEST_ERROR_MESSAGES = {
+    'timeout': "Local API request timed out. Check if your local server is running and responsive.",
+    'connection': "Failed to connect to local API at {url}. Check if your local server is running.",
+    404: "Local API endpoint not found. Check your API URL configuration.",
+    500: "Local API server error. Check your local server logs."
+}
+
+# Request bodies below this size aren't worth gzipping
+GZIP_MIN_BYTES = 16 * 1024
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+MAX_RETRIES = 3
+MAX_RETRY_DELAY = 60.0
+
+def _parse_reset_duration(value):
+    """Parse OpenAI's x-ratelimit-reset-* durations such as '1s', '6m0s' or '120ms' into seconds"""
+    units = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+    parts = re.findall(r"([\d.]+)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before retrying: the server's hint when given, else exponential backoff, plus jitter"""
+    delay = None
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+    if delay is None:
+        for header in ('x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens'):
+            if header in response.headers:
+                delay = _parse_reset_duration(response.headers[header])
+                if delay is not None:
+                    break
+    if delay is None:
+        delay = 2 ** attempt
+    return min(max(delay, 0.0), MAX_RETRY_DELAY) + random.uniform(0, 1)
+
+# Internal model names mapped to the API model names, keyed by (backend, model)
+MODEL_NAME_MAP = types.MappingProxyType({
+    # OpenAI
+    ('openai', 'gpt-4.1'): 'gpt-4.1-2025-04-14',
+    ('openai', 'gpt-4.1-mini'): 'gpt-4.1-mini-2025-04-14',
+    ('openai', 'gpt-4.1-nano'): 'gpt-4.1-nano-2025-04-14',
+    ('openai', 'o3'): 'o3-2025-01-31',
+    ('openai', 'o3-mini'): 'o3-mini-2025-01-31',
+    ('openai', 'o4-mini'): 'o4-mini-2025-01-31',
+    ('openai', 'gpt-4o'): 'gpt-4o-2024-11-20',
+    ('openai', 'gpt-4o-mini'): 'gpt-4o-mini-2024-07-18',
+    ('openai', 'o1'): 'o1-preview-2024-09-12',
+    ('openai', 'o1-mini'): 'o1-mini-2024-09-12',
+    # Anthropic
+    ('anthropic', 'claude-4-opus'): 'claude-opus-4-20250514',
+    ('anthropic', 'claude-4-sonnet'): 'claude-sonnet-4-20250514',
+    ('anthropic', 'claude-3.7-sonnet'): 'claude-3-7-sonnet-20250219',
+    ('anthropic', 'claude-3.5-sonnet'): 'claude-3-5-sonnet-20241022',
+    ('anthropic', 'claude-3.5-haiku'): 'claude-3-5-haiku-20241022',
+    ('anthropic', 'claude-3-opus'): 'claude-3-opus-20240229',
+    ('anthropic', 'claude-3-sonnet'): 'claude-3-sonnet-20240229',
+    ('anthropic', 'claude-3-haiku'): 'claude-3-haiku-20240307',
+    # Gemini
+    ('gemini', 'gemini-2.5-pro'): 'gemini-2.5-pro',
+    ('gemini', 'gemini-2.5-flash'): 'gemini-2.5-flash',
+    ('gemini', 'gemini-2.5-flash-lite'): 'gemini-2.5-flash-lite-preview-06-17',
+    ('gemini', 'gemini-2.0-flash'): 'gemini-2.0-flash-001',
+    ('gemini', 'gemini-2.0-flash-lite'): 'gemini-2.0-flash-lite-001',
+    ('gemini', 'gemini-1.5-pro'): 'gemini-1.5-pro-latest',
+    ('gemini', 'gemini-1.5-flash'): 'gemini-1.5-flash-latest',
+    ('gemini', 'gemini-1.5-flash-8b'): 'gemini-1.5-flash-8b-latest'
+})
+
+# OpenAI models that accept image input, by internal and API name
+OPENAI_VISION_MODELS = frozenset([
+    'gpt-4o', 'gpt-4o-mini', 'gpt-4o-2024-11-20', 'gpt-4o-mini-2024-07-18',
+    'gpt-4.1', 'gpt-4.1-mini', 'gpt-4.1-2025-04-14', 'gpt-4.1-mini-2025-04-14'
+])
+
+# API model name prefixes of models that support a thinking budget
+ANTHROPIC_THINKING_PREFIXES = ('claude-opus-4', 'claude-sonnet-4', 'claude-4', 'claude-3-7', 'claude-3.7')
+GEMINI_THINKING_PREFIXES = ('gemini-2.5', 'gemini-2.0')
+
+# Output token limits of the Anthropic thinking models, which bound thinking plus answer,
+# and the smallest thinking budget the API accepts
+ANTHROPIC_MAX_OUTPUT_TOKENS = (('claude-opus-4', 32000), ('claude-sonnet-4', 64000), ('claude-3-7', 64000))
+ANTHROPIC_MIN_THINKING_TOKENS = 1024
+
+# Token budgets for the thinking_budget preference levels
+THINKING_BUDGET_TOKENS = types.MappingProxyType({
+    'low': 2000,
+    'medium': 8000,
+    'high': 32000,
+    'max': 64000
+})
+
+# Three-component vectors as printed in prompts, e.g. [1.234, 0.0, -2.5]
+_NUMBER = r"-?\d+(?:\.\d+)?(?:e-?\d+)?"
+PROMPT_VECTOR_PATTERN = re.compile(rf"\[({_NUMBER}), ({_NUMBER}), ({_NUMBER})\]")
+# Selected objects of one type listed in full before the rest are summarized by name
+COMPRESSED_SELECTION_PER_TYPE = 8
+
+# Screenshot size used for general scene context; the full preference resolution is only used
+# when the request asks about visual detail
+CONTEXT_SCREENSHOT_RESOLUTION = 512
+DETAIL_REQUEST_PATTERN = re.compile(r"\b(details?|detailed|closely|close-?up|zoom\w*|textures?|precise(ly)?)\b", re.IGNORECASE)
+
+# Bumped by the depsgraph handler; cached scene context is only valid for the generation it was built in
+_scene_generation = 0
+
+@persistent
+def _on_scene_update(*args):
+    global _scene_generation
+    _scene_generation += 1
+
+def scene_generation():
+    """Counter that changes whenever the depsgraph reports an update or a file is loaded"""
+    return _scene_generation
+
+def register_handlers():
+    """Install the handlers that invalidate cached scene data"""
+    for handlers in (bpy.app.handlers.depsgraph_update_post, bpy.app.handlers.load_post):
+        if _on_scene_update not in handlers:
+            handlers.append(_on_scene_update)
+
+def unregister_handlers():
+    for handlers in (bpy.app.handlers.depsgraph_update_post, bpy.app.handlers.load_post):
+        if _on_scene_update in handlers:
+            handlers.remove(_on_scene_update)
+
+# Background asyncio loop that runs network calls so Blender's UI thread never blocks
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop():
+    """Return the background event loop, starting its thread on first use"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None or _event_loop.is_closed():
+            _event_loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_event_loop.run_forever, name="BlendAI-async", daemon=True)
+            thread.start()
+    return _event_loop
+
+def shutdown_event_loop():
+    """Stop the background event loop (called when the addon is unregistered)"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is not None and not _event_loop.is_closed():
+            _event_loop.call_soon_threadsafe(_event_loop.stop)
+        _event_loop = None
+
 class AIClient:
     def __init__(self, backend='openai'):
         self.backend = backend
-        self.response_log = []
+        self.response_log = deque(maxlen=RESPONSE_LOG_MAX_ENTRIES)
         self.previous_scene_state = None
+        self.response_cache = ResponseCache()
+        self.session = _create_session()
+        self._context_cache = None
+        self._context_cache_key = None
+        self._last_shot = None
+        self._offscreen = None
+        self._screenshot_path = None
+        self._token_counts = {}
+        self._prompt_cache = OrderedDict()
         self._max_context_tokens = {
             'openai': 128000,  # GPT-4 context limit
             'anthropic': 200000,  # Claude context limit
@@ -26,7 +441,7 @@ class AIClient:
     def sync_backend_with_prefs(self):
         """Ensure backend is in sync with user preferences"""
         try:
-            addon_prefs = bpy.context.preferences.addons[__package__].preferences
+            addon_prefs = get_addon_preferences()
             preferred_backend = addon_prefs.ai_provider.lower()
             if preferred_backend != self.backend:
                 self.backend = preferred_backend
@@ -36,119 +451,227 @@ class AIClient:
     def get_api_key(self):
         """Securely get API key from Blender's preferences"""
         try:
-            addon_prefs = bpy.context.preferences.addons[__package__].preferences
-            if self.backend == 'openai':
-                return addon_prefs.openai_api_key
-            elif self.backend == 'anthropic':
-                return addon_prefs.anthropic_api_key
-            elif self.backend == 'gemini':
-                return addon_prefs.gemini_api_key
-            elif self.backend == 'local':
+            if self.backend == 'local':
                 return "local"  # Local doesn't need API key
+            elif self.backend in ('openai', 'anthropic', 'gemini'):
+                return get_addon_preferences().provider_api_key(self.backend)
             else:
                 raise AIBackendError(f"Unknown backend: {self.backend}")
         except Exception as e:
             raise AIBackendError(f"Failed to retrieve API key for {self.backend}: {str(e)}")
 
-    def map_model_name(self, model_name, backend):
+    def request_settings(self, backend, **kwargs):
+        """Resolve preference-backed settings (API key, model, URL) for a backend call.
+
+        Preferences are only read for keys missing from kwargs, so a resolved dict can
+        be handed to a worker thread without the call_* methods touching bpy.
+        """
+        settings = {key: value for key, value in kwargs.items() if value is not None}
+        if backend == 'local':
+            required = ('api_url', 'model')
+        elif backend in ('openai', 'anthropic', 'gemini'):
+            required = ('api_key', 'model', 'thinking_budget')
+        else:
+            return settings
+        if all(key in settings for key in required):
+            return settings
+        
+        addon_prefs = get_addon_preferences()
+        if backend == 'local':
+            if 'api_url' not in settings:
+                settings['api_url'] = addon_prefs.local_api_url
+            if 'model' not in settings:
+                settings['model'] = addon_prefs.local_model
+        else:
+            if 'api_key' not in settings:
+                settings['api_key'] = addon_prefs.provider_api_key(backend)
+            if 'model' not in settings:
+                settings['model'] = addon_prefs.provider_model(backend)
+            if 'thinking_budget' not in settings:
+                settings['thinking_budget'] = addon_prefs.thinking_budget
+        return settings
+
+    @staticmethod
+    def map_model_name(model_name, backend):
         """Map internal model names to API model names"""
-        # OpenAI model mapping
-        if backend == 'openai':
-            model_map = {
-                'gpt-4.1': 'gpt-4.1-2025-04-14',
-                'gpt-4.1-mini': 'gpt-4.1-mini-2025-04-14', 
-                'gpt-4.1-nano': 'gpt-4.1-nano-2025-04-14',
-                'o3': 'o3-2025-01-31',
-                'o3-mini': 'o3-mini-2025-01-31',
-                'o4-mini': 'o4-mini-2025-01-31',
-                'gpt-4o': 'gpt-4o-2024-11-20',
-                'gpt-4o-mini': 'gpt-4o-mini-2024-07-18',
-                'o1': 'o1-preview-2024-09-12',
-                'o1-mini': 'o1-mini-2024-09-12'
-            }
-            return model_map.get(model_name, model_name)
-            
-        # Anthropic model mapping  
-        elif backend == 'anthropic':
-            model_map = {
-                'claude-4-opus': 'claude-opus-4-20250514',
-                'claude-4-sonnet': 'claude-sonnet-4-20250514',
-                'claude-3.7-sonnet': 'claude-3-7-sonnet-20250219',
-                'claude-3.5-sonnet': 'claude-3-5-sonnet-20241022',
-                'claude-3.5-haiku': 'claude-3-5-haiku-20241022',
-                'claude-3-opus': 'claude-3-opus-20240229',
-                'claude-3-sonnet': 'claude-3-sonnet-20240229',
-                'claude-3-haiku': 'claude-3-haiku-20240307'
-            }
-            return model_map.get(model_name, model_name)
-            
-        # Gemini model mapping
-        elif backend == 'gemini':
-            model_map = {
-                'gemini-2.5-pro': 'gemini-2.5-pro',
-                'gemini-2.5-flash': 'gemini-2.5-flash',
-                'gemini-2.5-flash-lite': 'gemini-2.5-flash-lite-preview-06-17',
-                'gemini-2.0-flash': 'gemini-2.0-flash-001',
-                'gemini-2.0-flash-lite': 'gemini-2.0-flash-lite-001',
-                'gemini-1.5-pro': 'gemini-1.5-pro-latest',
-                'gemini-1.5-flash': 'gemini-1.5-flash-latest',
-                'gemini-1.5-flash-8b': 'gemini-1.5-flash-8b-latest'
-            }
-            return model_map.get(model_name, model_name)
-            
-        return model_name
+        return MODEL_NAME_MAP.get((backend, model_name), model_name)
 
     def capture_viewport_screenshot(self):
         """Capture a screenshot of the 3D viewport and return base64 encoded image"""
+        shot = self.capture_viewport()
+        return shot.encode() if shot else None
+
+    def capture_viewport(self, detail=True):
+        """Grab the 3D viewport as a ViewportShot without encoding it; must run on the main thread.
+
+        With detail=False the capture is capped at CONTEXT_SCREENSHOT_RESOLUTION.
+        """
         try:
-            addon_prefs = bpy.context.preferences.addons[__package__].preferences
-            resolution = int(addon_prefs.max_screenshot_resolution)
-            
-            # Save current render settings
+            addon_prefs = get_addon_preferences()
+            resolution = addon_prefs.screenshot_resolution()
+            quality = addon_prefs.screenshot_quality
+            if not detail:
+                resolution = min(resolution, CONTEXT_SCREENSHOT_RESOLUTION)
             scene = bpy.context.scene
-            render = scene.render
-            original_resolution_x = render.resolution_x
-            original_resolution_y = render.resolution_y
-            original_filepath = render.filepath
             
-            # Set screenshot resolution
-            render.resolution_x = resolution
-            render.resolution_y = resolution
+            # Reuse the last capture when neither the scene nor the captured view has changed
+            shot_key = (_scene_generation, scene.frame_current, resolution, quality, self._view_key())
+            if self._last_shot is not None and self._last_shot[0] == shot_key:
+                return self._last_shot[1]
             
-            # Create temporary file
-            temp_dir = tempfile.gettempdir()
-            screenshot_path = os.path.join(temp_dir, "blendai_viewport.png")
-            render.filepath = screenshot_path
+            # Draw the viewport straight into GPU memory; fall back to an OpenGL render
+            # through a temp file when there is no 3D view to draw (e.g. background mode)
+            shot = None
+            try:
+                pixels = self._capture_offscreen(resolution)
+                if pixels is not None:
+                    shot = ViewportShot(pixels=pixels, quality=quality)
+            except Exception as e:
+                print(f"Offscreen viewport capture failed, falling back to OpenGL render: {e}")
+            if shot is None:
+                image_bytes = self._capture_with_render(resolution, quality)
+                if image_bytes:
+                    shot = ViewportShot(image_bytes=image_bytes, mime_type='image/jpeg')
             
+            if shot is not None:
+                # Scene updates like selection changes often leave the pixels identical
+                if self._last_shot is not None and self._last_shot[1].digest == shot.digest:
+                    shot = self._last_shot[1]
+                self._last_shot = (shot_key, shot)
+                return shot
+                    
+        except Exception as e:
+            print(f"Error capturing viewport screenshot: {e}")
+            
+        return None
+
+    def _find_view3d(self):
+        """Return (space, region) of the 3D viewport to capture, preferring the current area"""
+        area = bpy.context.area
+        if area is None or area.type != 'VIEW_3D':
+            screen = bpy.context.screen
+            area = next((a for a in screen.areas if a.type == 'VIEW_3D'), None) if screen else None
+        if area is None:
+            return None, None
+        region = next((r for r in area.regions if r.type == 'WINDOW'), None)
+        return area.spaces.active, region
+
+    def _view_key(self):
+        """Everything about the viewport _capture_offscreen draws that changes its pixels without a depsgraph update"""
+        space, region = self._find_view3d()
+        if region is None:
+            return ()
+        region_3d = space.region_3d
+        return (
+            region.width, region.height, space.shading.type,
+            tuple(value for row in region_3d.view_matrix for value in row),
+            tuple(value for row in region_3d.window_matrix for value in row),
+        )
+
+    def _capture_offscreen(self, resolution):
+        """Draw the viewport into a cached GPUOffScreen and return its RGBA pixels, or None without a 3D view"""
+        import gpu  # Only needed for captures; unavailable without a GPU context (e.g. background mode)
+        
+        space, region = self._find_view3d()
+        if region is None or region.width <= 0 or region.height <= 0:
+            return None
+        
+        # Keep the viewport's aspect ratio with the longest side at the requested resolution
+        scale = resolution / max(region.width, region.height)
+        width = max(1, int(region.width * scale))
+        height = max(1, int(region.height * scale))
+        
+        offscreen = self._offscreen
+        if offscreen is None or offscreen.width != width or offscreen.height != height:
+            if offscreen is not None:
+                offscreen.free()
+            offscreen = self._offscreen = gpu.types.GPUOffScreen(width, height)
+        
+        region_3d = space.region_3d
+        offscreen.draw_view3d(
+            bpy.context.scene, bpy.context.view_layer, space, region,
+            region_3d.view_matrix, region_3d.window_matrix, do_color_management=True
+        )
+        with offscreen.bind():
+            framebuffer = gpu.state.active_framebuffer_get()
+            buffer = framebuffer.read_color(0, 0, width, height, 4, 0, 'UBYTE')
+        buffer.dimensions = width * height * 4
+        
+        # GPU rows start at the bottom; PNG rows start at the top
+        return np.asarray(buffer, dtype=np.uint8).reshape(height, width, 4)[::-1]
+
+    def _capture_with_render(self, resolution, quality=85):
+        """Fallback capture through bpy.ops.render.opengl and a temp file; returns JPEG bytes or None"""
+        
+        # Save current render settings
+        scene = bpy.context.scene
+        render = scene.render
+        original_resolution_x = render.resolution_x
+        original_resolution_y = render.resolution_y
+        original_filepath = render.filepath
+        image_settings = render.image_settings
+        original_format = (image_settings.file_format, image_settings.color_mode, image_settings.quality)
+        
+        # Set screenshot resolution
+        render.resolution_x = resolution
+        render.resolution_y = resolution
+        
+        # JPEG keeps the upload (and the provider's image tokens) several times smaller than PNG
+        image_settings.file_format = 'JPEG'
+        image_settings.color_mode = 'RGB'
+        image_settings.quality = quality
+        
+        # Render Result pixels can't be read from Python, so the image has to pass through a file.
+        # The path is chosen once and overwritten in place on later captures; on Linux it lives in
+        # RAM-backed /dev/shm so the round trip never reaches the disk
+        if self._screenshot_path is None:
+            temp_dir = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+            # The process id keeps concurrent Blender instances from overwriting each other's capture
+            self._screenshot_path = os.path.join(temp_dir, f"blendai_viewport_{os.getpid()}.jpg")
+        screenshot_path = self._screenshot_path
+        render.filepath = screenshot_path
+        # Truncate rather than delete so a render that silently writes nothing can't return the previous capture
+        open(screenshot_path, "wb").close()
+        
+        try:
             # Take screenshot
             bpy.ops.render.opengl(write_still=True)
-            
+        finally:
             # Restore original settings
             render.resolution_x = original_resolution_x
             render.resolution_y = original_resolution_y
             render.filepath = original_filepath
-            
-            # Read and encode image
-            if os.path.exists(screenshot_path):
-                with open(screenshot_path, "rb") as image_file:
-                    encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-                    os.remove(screenshot_path)  # Clean up
-                    return encoded_image
-                    
-        except Exception as e:
-            print(f"Error capturing viewport screenshot: {e}")
-            
-        return None
+            image_settings.file_format, image_settings.color_mode, image_settings.quality = original_format
+        
+        # Read image
+        with open(screenshot_path, "rb") as image_file:
+            return image_file.read() or None
 
     def estimate_token_count(self, text):
-        """Rough estimation of token count (approximately 4 characters per token)"""
-        return len(text) // 4
+        """Token count from tiktoken when available, else roughly 4 characters per token.
+
+        o200k is OpenAI's tokenizer; for the other providers it is a closer approximation than
+        the character heuristic.
+        """
+        encoding = _get_tokenizer()
+        if encoding is None:
+            return len(text) // 4
+        
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        count = self._token_counts.get(key)
+        if count is None:
+            count = len(encoding.encode(text, disallowed_special=()))
+            if len(self._token_counts) >= TOKEN_COUNT_CACHE_SIZE:
+                self._token_counts.clear()
+            self._token_counts[key] = count
+        return count
     
     def trim_context_if_needed(self, context, max_tokens):
         """Trim context to fit within token limits while preserving essential information"""
         # Always preserve essential context
         essential_keys = ['scene_name', 'mode', 'blender_version', 'render_engine', 
-                         'selected_objects', 'active_object', 'total_objects']
+                         'selected_objects', 'active_object', 'total_objects',
+                         'frame_current', 'frame_range', 'object_types']
         
         # Start with essential context
         trimmed_context = {key: context[key] for key in essential_keys if key in context}
@@ -166,11 +689,51 @@ class AIClient:
                 else:
                     trimmed_context[key] = context[key]
         
+        # Halve the bulkiest lists until the context fits the token budget. The text is tokenized
+        # once; later rounds scale that count by length, since halving keeps the same kind of text
+        text = str(trimmed_context)
+        tokens_per_char = self.estimate_token_count(text) / max(len(text), 1)
+        while len(text) * tokens_per_char > max_tokens:
+            largest = max(('all_objects', 'materials'), key=lambda key: len(trimmed_context.get(key, ())))
+            if len(trimmed_context.get(largest, ())) <= 1:
+                break
+            trimmed_context[largest] = trimmed_context[largest][:len(trimmed_context[largest]) // 2]
+            text = str(trimmed_context)
+        
         return trimmed_context
     
     def get_detailed_scene_context(self, trim_for_backend=None):
         """Get comprehensive scene context including all objects, materials, etc."""
         scene = bpy.context.scene
+        cache_key = self._scene_cache_key()
+        
+        if self._context_cache is not None and self._context_cache_key == cache_key:
+            context = dict(self._context_cache)
+            # Mode and frame change without a depsgraph update, so refresh them on every hit
+            context['mode'] = bpy.context.mode
+            context['frame_current'] = scene.frame_current if scene else None
+            context['frame_range'] = f"{scene.frame_start}-{scene.frame_end}" if scene else None
+        else:
+            context = self._build_scene_context()
+            self._context_cache = context
+            self._context_cache_key = cache_key
+        
+        # Apply token management if backend specified
+        if trim_for_backend and trim_for_backend in self._max_context_tokens:
+            max_tokens = self._max_context_tokens[trim_for_backend] // 4  # Reserve 3/4 for response
+            context = self.trim_context_if_needed(context, max_tokens)
+        
+        return context
+
+    @staticmethod
+    def _scene_cache_key():
+        """Key that changes whenever cached scene context goes stale"""
+        # Counts catch data changes made while handlers were not running (e.g. during file load)
+        return (_scene_generation, len(bpy.data.objects), len(bpy.data.materials), len(bpy.data.collections))
+
+    def _build_scene_context(self):
+        """Walk the scene and collect the full (untrimmed) context dict"""
+        scene = bpy.context.scene
         context = {
             'scene_name': scene.name if scene else None,
             'selected_objects': [],
@@ -188,17 +751,37 @@ class AIClient:
             'frame_range': f"{scene.frame_start}-{scene.frame_end}" if scene else None
         }
         
+        # Bulk-read transforms for every object in one C call per property instead of
+        # per-object RNA access; float64 buffers keep the rounded values clean
+        objects = bpy.data.objects[:]
+        count = len(objects)
+        locations = np.empty(count * 3, dtype=np.float64)
+        rotations = np.empty(count * 3, dtype=np.float64)
+        scales = np.empty(count * 3, dtype=np.float64)
+        bpy.data.objects.foreach_get("location", locations)
+        bpy.data.objects.foreach_get("rotation_euler", rotations)
+        bpy.data.objects.foreach_get("scale", scales)
+        locations = np.round(locations.reshape(count, 3), 3).tolist()
+        rotations = np.round(rotations.reshape(count, 3), 3).tolist()
+        scales = np.round(scales.reshape(count, 3), 3).tolist()
+        object_index = {obj: i for i, obj in enumerate(objects)}
+        # Types are read once and reused for the type counts, selection, lights and cameras below
+        object_types = [obj.type for obj in objects]
+        context['object_types'] = dict(Counter(object_types))
+        
         # Selected objects with detailed info
         for obj in bpy.context.selected_objects:
+            i = object_index[obj]
+            obj_type = object_types[i]
             obj_info = {
                 'name': obj.name,
-                'type': obj.type,
-                'location': [round(x, 3) for x in obj.location],
-                'rotation': [round(x, 3) for x in obj.rotation_euler],
-                'scale': [round(x, 3) for x in obj.scale]
+                'type': obj_type,
+                'location': locations[i],
+                'rotation': rotations[i],
+                'scale': scales[i]
             }
             
-            if obj.type == 'MESH' and obj.data:
+            if obj_type == 'MESH' and obj.data:
                 obj_info.update({
                     'vertices': len(obj.data.vertices),
                     'edges': len(obj.data.edges),
@@ -212,35 +795,40 @@ class AIClient:
         if bpy.context.active_object:
             context['active_object'] = bpy.context.active_object.name
             
-        # All objects summary
-        for obj in bpy.data.objects:
-            obj_summary = {
+        # All objects summary; one visible_objects call replaces a visible_get() per object
+        visible = set(bpy.context.visible_objects)
+        context['all_objects'] = [
+            {
                 'name': obj.name,
-                'type': obj.type,
-                'visible': obj.visible_get(),
-                'location': [round(x, 3) for x in obj.location]
+                'type': obj_type,
+                'visible': obj in visible,
+                'location': location
             }
-            context['all_objects'].append(obj_summary)
+            for obj, obj_type, location in zip(objects, object_types, locations)
+        ]
             
-        # Materials
-        for mat in bpy.data.materials:
-            mat_info = {
-                'name': mat.name,
-                'use_nodes': mat.use_nodes,
-                'users': mat.users
-            }
-            context['materials'].append(mat_info)
+        # Materials; flags and user counts are bulk-read like the transforms above
+        materials = bpy.data.materials
+        material_count = len(materials)
+        use_nodes = np.empty(material_count, dtype=bool)
+        users = np.empty(material_count, dtype=np.int32)
+        materials.foreach_get("use_nodes", use_nodes)
+        materials.foreach_get("users", users)
+        context['materials'] = [
+            {'name': name, 'use_nodes': uses_nodes, 'users': user_count}
+            for name, uses_nodes, user_count in zip(materials.keys(), use_nodes.tolist(), users.tolist())
+        ]
             
         # Lights
         context['lights'] = [
             {'name': obj.name, 'type': obj.data.type, 'energy': obj.data.energy}
-            for obj in bpy.data.objects if obj.type == 'LIGHT'
+            for obj, obj_type in zip(objects, object_types) if obj_type == 'LIGHT'
         ]
         
         # Cameras
         context['cameras'] = [
             {'name': obj.name, 'lens': obj.data.lens}
-            for obj in bpy.data.objects if obj.type == 'CAMERA'
+            for obj, obj_type in zip(objects, object_types) if obj_type == 'CAMERA'
         ]
         
         # Collections
@@ -249,134 +837,176 @@ class AIClient:
             for col in bpy.data.collections
         ]
         
-        # Apply token management if backend specified
-        if trim_for_backend and trim_for_backend in self._max_context_tokens:
-            max_tokens = self._max_context_tokens[trim_for_backend] // 4  # Reserve 3/4 for response
-            context = self.trim_context_if_needed(context, max_tokens)
-        
         return context
 
-    def build_prompt(self, user_request):
+    def _format_selected_object(self, obj):
+        """Prompt lines describing one selected object"""
+        mesh = f"  Mesh: {obj['vertices']} verts, {obj['faces']} faces\n" if 'vertices' in obj else ""
+        materials = f"  Materials: {', '.join(obj['materials'])}\n" if obj.get('materials') else ""
+        return (
+            f"- {obj['name']} ({obj['type']})\n"
+            f"  Location: {obj['location']}, Rotation: {obj['rotation']}, Scale: {obj['scale']}\n"
+            f"{mesh}{materials}"
+        )
+
+    def build_prompt(self, user_request, backend=None):
         """Build comprehensive prompt with scene context and optional screenshot"""
-        # Sync backend with preferences before building prompt
-        self.sync_backend_with_prefs()
+        # Sync backend with preferences unless the caller chose one explicitly
+        if backend is None:
+            self.sync_backend_with_prefs()
+            backend = self.backend
         
-        context = self.get_detailed_scene_context(trim_for_backend=self.backend)
-        addon_prefs = bpy.context.preferences.addons[__package__].preferences
+        screenshot_data = None
+        if get_pref('enable_viewport_screenshot'):
+            # A small capture is enough for scene context unless the request is about visual detail
+            screenshot_data = self.capture_viewport(detail=bool(DETAIL_REQUEST_PATTERN.search(user_request)))
+        
+        # Rewording bursts hit the same scene; skip the context trim and prompt assembly for repeats
+        scene = bpy.context.scene
+        prompt_key = (
+            self._scene_cache_key(), bpy.context.mode, scene.frame_current, scene.frame_start, scene.frame_end,
+            backend, user_request, screenshot_data is not None
+        )
+        prompt = self._prompt_cache.get(prompt_key)
+        if prompt is not None:
+            self._prompt_cache.move_to_end(prompt_key)
+            return prompt, screenshot_data
+        
+        context = self.get_detailed_scene_context(trim_for_backend=backend)
         
         # Enhanced system prompt
-        system_prompt = (
-            "You are BlendAI, an expert Blender Python (bpy) code generator specialized in creating high-quality 3D content.\n"
-            "You have deep knowledge of Blender's API, best practices, and 3D modeling workflows.\n\n"
-            "CORE RULES:\n"
-            "1. Generate ONLY clean, executable Python code using the Blender API (bpy)\n"
-            "2. Include comprehensive error handling with try-except blocks\n" 
-            "3. Add clear, helpful comments explaining each step\n"
-            "4. Ensure code is safe and won't crash Blender\n"
-            "5. Use proper Blender conventions and best practices\n"
-            "6. Do NOT include markdown, explanations, or anything except Python code\n"
-            "7. Test for object existence before manipulating\n"
-            "8. Use appropriate selection and active object management\n\n"
-            "DETAILED SCENE CONTEXT:\n"
+        parts = [
+            PROMPT_PREFIX,
             f"Scene: '{context['scene_name']}' | Mode: {context['mode']} | Blender: {context['blender_version']}\n"
             f"Render Engine: {context['render_engine']} | Frame: {context['frame_current']} ({context['frame_range']})\n\n"
-        )
+        ]
         
         # Selected Objects Details
         if context['selected_objects']:
-            system_prompt += "SELECTED OBJECTS:\n"
-            for obj in context['selected_objects']:
-                system_prompt += f"• {obj['name']} ({obj['type']})\n"
-                system_prompt += f"  Location: {obj['location']}, Rotation: {obj['rotation']}, Scale: {obj['scale']}\n"
-                if 'vertices' in obj:
-                    system_prompt += f"  Mesh: {obj['vertices']} verts, {obj['faces']} faces\n"
-                if obj.get('materials'):
-                    system_prompt += f"  Materials: {', '.join(obj['materials'])}\n"
+            parts.append("SELECTED OBJECTS:\n")
+            parts.extend(self._format_selected_object(obj) for obj in context['selected_objects'])
         else:
-            system_prompt += "SELECTED OBJECTS: None\n"
+            parts.append("SELECTED OBJECTS: None\n")
             
         # Active Object
-        system_prompt += f"ACTIVE OBJECT: {context['active_object'] or 'None'}\n\n"
+        parts.append(f"ACTIVE OBJECT: {context['active_object'] or 'None'}\n\n")
         
         # Scene Statistics
-        system_prompt += "SCENE OVERVIEW:\n"
-        object_types = {}
-        for obj in context['all_objects']:
-            obj_type = obj['type']
-            object_types[obj_type] = object_types.get(obj_type, 0) + 1
-            
-        for obj_type, count in object_types.items():
-            system_prompt += f"• {obj_type}: {count}\n"
-            
-        system_prompt += f"• Total Objects: {context['total_objects']}\n"
-        system_prompt += f"• Materials: {len(context['materials'])}\n"
-        system_prompt += f"• Collections: {len(context['collections'])}\n\n"
+        parts.append("SCENE OVERVIEW:\n")
+        parts.extend(f"- {obj_type}: {count}\n" for obj_type, count in context['object_types'].items())
+        parts.append(
+            f"- Total Objects: {context['total_objects']}\n"
+            f"- Materials: {len(context['materials'])}\n"
+            f"- Collections: {len(context['collections'])}\n\n"
+        )
         
         # Collections Info
         if context['collections']:
-            system_prompt += "COLLECTIONS:\n"
-            for col in context['collections']:
-                system_prompt += f"• {col['name']}: {col['objects']} objects\n"
-            system_prompt += "\n"
+            parts.append("COLLECTIONS:\n")
+            parts.extend(f"- {col['name']}: {col['objects']} objects\n" for col in context['collections'])
+            parts.append("\n")
             
         # Materials Info
         if context['materials']:
-            system_prompt += "MATERIALS:\n"
-            for mat in context['materials'][:10]:  # Limit to first 10
-                system_prompt += f"• {mat['name']} (nodes: {mat['use_nodes']}, users: {mat['users']})\n"
+            parts.append("MATERIALS:\n")
+            parts.extend(
+                f"- {mat['name']} (nodes: {mat['use_nodes']}, users: {mat['users']})\n"
+                for mat in context['materials'][:10]  # Limit to first 10
+            )
             if len(context['materials']) > 10:
-                system_prompt += f"• ... and {len(context['materials']) - 10} more materials\n"
-            system_prompt += "\n"
-            
-        # User Request
-        system_prompt += f"USER REQUEST:\n{user_request}\n\n"
-        
-        system_prompt += (
-            "Generate Python code that fulfills this request. The code should:\n"
-            "- Work with the current scene context\n"
-            "- Be production-ready and efficient\n"
-            "- Include error handling and validation\n"
-            "- Follow Blender best practices\n"
-            "- Return ONLY executable Python code\n"
-        )
+                parts.append(f"- ... and {len(context['materials']) - 10} more materials\n")
+            parts.append("\n")
+            
+        # User Request; everything before this marker is a stable prefix that providers can cache
+        parts.append(f"{PROMPT_REQUEST_MARKER}{user_request}\n\n")
+        parts.append(PROMPT_SUFFIX)
+        if screenshot_data:
+            parts.append(PROMPT_SCREENSHOT_NOTE)
         
-        # Add screenshot if enabled
-        screenshot_data = None
-        if addon_prefs.enable_viewport_screenshot:
-            screenshot_data = self.capture_viewport_screenshot()
-            if screenshot_data:
-                system_prompt += "\n[VIEWPORT SCREENSHOT INCLUDED - Use this visual context to better understand the current scene]\n"
+        prompt = "".join(parts)
+        # Very large selections can crowd out the response; compress past half the context window
+        token_budget = self._max_context_tokens.get(backend, 32000) // 2
+        if self.estimate_token_count(prompt) > token_budget:
+            prompt = self.compress_prompt(prompt, token_budget)
         
-        return system_prompt, screenshot_data
+        self._prompt_cache[prompt_key] = prompt
+        if len(self._prompt_cache) > PROMPT_CACHE_SIZE:
+            self._prompt_cache.popitem(last=False)
+        return prompt, screenshot_data
 
-    def store_scene_state(self):
-        """Store current scene state for diff comparison"""
-        self.previous_scene_state = {
-            'objects': [obj.name for obj in bpy.data.objects],
-            'materials': [mat.name for mat in bpy.data.materials],
-            'collections': [col.name for col in bpy.data.collections],
+    def _snapshot_scene_state(self):
+        """Names of the datablocks the diff tracks; frozensets built straight from the C-level key lists"""
+        return {
+            'objects': frozenset(bpy.data.objects.keys()),
+            'materials': frozenset(bpy.data.materials.keys()),
+            'collections': frozenset(bpy.data.collections.keys()),
             'selected': [obj.name for obj in bpy.context.selected_objects],
             'active': bpy.context.active_object.name if bpy.context.active_object else None
         }
 
+    def compress_prompt(self, text, target_tokens):
+        """Shrink an oversized prompt: quantize vectors, drop identity transforms, then summarize long selections"""
+        def quantize(match):
+            # + 0.0 turns -0.0 into 0.0 so zero vectors compare equal below
+            return "[" + ", ".join(
+                f"{round(float(value), 2) + 0.0:.2f}".rstrip('0').rstrip('.') for value in match.groups()
+            ) + "]"
+        
+        # Only the scene context is rewritten; coordinates the user typed in the request stay exact
+        scene_text, request_marker, request_text = text.partition(PROMPT_REQUEST_MARKER)
+        scene_text = PROMPT_VECTOR_PATTERN.sub(quantize, scene_text)
+        scene_text = scene_text.replace(", Rotation: [0, 0, 0]", "").replace(", Scale: [1, 1, 1]", "")
+        scene_text = scene_text.replace("Location: [0, 0, 0]", "Location: origin")
+        text = f"{scene_text}{request_marker}{request_text}"
+        if self.estimate_token_count(text) <= target_tokens:
+            return text
+        
+        # Still too large: keep the first few selected objects of each type in full and
+        # list the rest by name only
+        head, marker, rest = scene_text.partition("SELECTED OBJECTS:\n")
+        selection, active_marker, tail = rest.partition("ACTIVE OBJECT:")
+        if not marker or not active_marker:
+            return text
+        
+        kept = []
+        overflow = {}
+        per_type = {}
+        for entry in re.split(r"(?m)^(?=- )", selection):
+            header = re.match(r"- (.*) \((\w+)\)\n", entry)
+            if not header:
+                kept.append(entry)
+                continue
+            name, obj_type = header.groups()
+            per_type[obj_type] = per_type.get(obj_type, 0) + 1
+            if per_type[obj_type] <= COMPRESSED_SELECTION_PER_TYPE:
+                kept.append(entry)
+            else:
+                overflow.setdefault(obj_type, []).append(name)
+        kept.extend(
+            f"- {obj_type} x{len(names)} more: {', '.join(names)}\n"
+            for obj_type, names in overflow.items()
+        )
+        return f"{head}{marker}{''.join(kept)}{active_marker}{tail}{request_marker}{request_text}"
+
+    def store_scene_state(self):
+        """Store current scene state for diff comparison"""
+        self.previous_scene_state = self._snapshot_scene_state()
+
     def get_diff_summary(self):
         """Generate a summary of changes since last operation"""
         if not self.previous_scene_state:
             return "No previous state to compare."
-            
-        current_state = {
-            'objects': [obj.name for obj in bpy.data.objects],
-            'materials': [mat.name for mat in bpy.data.materials],
-            'collections': [col.name for col in bpy.data.collections],
-            'selected': [obj.name for obj in bpy.context.selected_objects],
-            'active': bpy.context.active_object.name if bpy.context.active_object else None
-        }
+        
+        previous_state = self.previous_scene_state
+        current_state = self._snapshot_scene_state()
         
         changes = []
         
         # Objects
-        added_objects = set(current_state['objects']) - set(self.previous_scene_state['objects'])
-        removed_objects = set(self.previous_scene_state['objects']) - set(current_state['objects'])
+        # One pass over both sets; the split into added/removed then only touches the changed names
+        changed_objects = current_state['objects'] ^ previous_state['objects']
+        added_objects = changed_objects & current_state['objects']
+        removed_objects = changed_objects - added_objects
         
         if added_objects:
             changes.append(f"✅ Added objects: {', '.join(added_objects)}")
@@ -384,24 +1014,24 @@ class AIClient:
             changes.append(f"❌ Removed objects: {', '.join(removed_objects)}")
             
         # Materials
-        added_materials = set(current_state['materials']) - set(self.previous_scene_state['materials'])
+        added_materials = current_state['materials'] - previous_state['materials']
         if added_materials:
             changes.append(f"🎨 Added materials: {', '.join(added_materials)}")
             
         # Collections
-        added_collections = set(current_state['collections']) - set(self.previous_scene_state['collections'])
+        added_collections = current_state['collections'] - previous_state['collections']
         if added_collections:
             changes.append(f"📁 Added collections: {', '.join(added_collections)}")
             
         # Selection changes
-        if current_state['selected'] != self.previous_scene_state['selected']:
+        if current_state['selected'] != previous_state['selected']:
             if current_state['selected']:
                 changes.append(f"🎯 Selected: {', '.join(current_state['selected'])}")
             else:
                 changes.append("🎯 Selection cleared")
                 
         # Active object changes
-        if current_state['active'] != self.previous_scene_state['active']:
+        if current_state['active'] != previous_state['active']:
             if current_state['active']:
                 changes.append(f"🎯 Active object: {current_state['active']}")
             else:
@@ -415,28 +1045,25 @@ class AIClient:
     def call_openai(self, prompt, screenshot_data=None, **kwargs):
         """Call OpenAI API with enhanced support and error handling"""
         try:
-            api_key = self.get_api_key()
+            settings = self.request_settings('openai', **kwargs)
+            api_key = settings.get('api_key')
             if not api_key:
                 raise AIBackendError("OpenAI API key not set in preferences")
             
-            addon_prefs = bpy.context.preferences.addons[__package__].preferences
-            model = self.map_model_name(kwargs.get('model', addon_prefs.openai_model), 'openai')
+            model = self.map_model_name(settings['model'], 'openai')
             
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
+            headers = {"Authorization": f"Bearer {api_key}"}
             
             # Build messages
             messages = [{"role": "user", "content": prompt}]
             
             # Add screenshot if available (for vision models)
-            if screenshot_data and model in ['gpt-4o', 'gpt-4o-mini', 'gpt-4o-2024-11-20', 'gpt-4o-mini-2024-07-18']:
+            if screenshot_data and model in OPENAI_VISION_MODELS:
                 messages = [{
                     "role": "user", 
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{screenshot_data}"}}
+                        {"type": "image_url", "image_url": {"url": f"data:{settings.get('image_mime_type', 'image/png')};base64,{screenshot_data}"}}
                     ]
                 }]
                 print(f"OpenAI: Including viewport screenshot for vision model {model}")
@@ -444,14 +1071,26 @@ class AIClient:
             data = {
                 "model": model,
                 "messages": messages,
-                "max_tokens": kwargs.get('max_tokens', 4000),
-                "temperature": kwargs.get('temperature', 0.1)
+                "max_tokens": settings.get('max_tokens', 4000),
+                "temperature": settings.get('temperature', 0.1)
             }
             
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data, timeout=60)
-            response.raise_for_status()
+            # OpenAI caches prompt prefixes automatically; every prompt starts with the same
+            # instructions, so key the cache routing on the scene context to keep scenes apart
+            context_text, marker, _ = prompt.partition(PROMPT_REQUEST_MARKER)
+            if marker:
+                data["prompt_cache_key"] = hashlib.blake2b(context_text.encode('utf-8'), digest_size=16).hexdigest()
             
-            result = response.json()
+            on_delta = settings.get('on_delta')
+            if on_delta:
+                data["stream"] = True
+            
+            result = self._post_json(
+                "https://api.openai.com/v1/chat/completions", headers, data, 'OpenAI',
+                on_delta=on_delta, extract=_openai_delta, compress=settings.get('compress_requests', False)
+            )
+            if on_delta:
+                return result
             
             if 'choices' in result and result['choices']:
                 return result['choices'][0]['message']['content']
@@ -461,40 +1100,36 @@ class AIClient:
             else:
                 raise AIBackendError("OpenAI API returned no choices in response")
                 
-        except requests.exceptions.Timeout:
-            raise AIBackendError("OpenAI API request timed out. Please try again.")
-        except requests.exceptions.ConnectionError:
-            raise AIBackendError("Failed to connect to OpenAI API. Check your internet connection.")
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 401:
-                raise AIBackendError("Invalid OpenAI API key. Please check your API key in preferences.")
-            elif e.response.status_code == 429:
-                raise AIBackendError("OpenAI API rate limit exceeded. Please wait and try again.")
-            elif e.response.status_code == 400:
-                raise AIBackendError("Invalid request to OpenAI API. Check your model selection and parameters.")
-            else:
-                raise AIBackendError(f"OpenAI API HTTP error {e.response.status_code}: {e.response.text}")
+        except AIBackendError:
+            raise
         except Exception as e:
             raise AIBackendError(f"Unexpected error calling OpenAI API: {str(e)}")
 
     def call_anthropic(self, prompt, screenshot_data=None, **kwargs):
         """Call Anthropic API with enhanced support and error handling"""
         try:
-            api_key = self.get_api_key()
+            settings = self.request_settings('anthropic', **kwargs)
+            api_key = settings.get('api_key')
             if not api_key:
                 raise AIBackendError("Anthropic API key not set in preferences")
                 
-            addon_prefs = bpy.context.preferences.addons[__package__].preferences
-            model = self.map_model_name(kwargs.get('model', addon_prefs.anthropic_model), 'anthropic')
+            model = self.map_model_name(settings['model'], 'anthropic')
             
             headers = {
                 "x-api-key": api_key,
-                "Content-Type": "application/json",
                 "anthropic-version": "2023-06-01"
             }
             
-            # Build content
-            content = [{"type": "text", "text": prompt}]
+            # Build content; the scene context is marked cacheable so repeated requests against
+            # the same scene only pay full prompt processing for the user's request
+            context_text, marker, request_text = prompt.partition(PROMPT_REQUEST_MARKER)
+            if marker:
+                content = [
+                    {"type": "text", "text": context_text, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": marker + request_text}
+                ]
+            else:
+                content = [{"type": "text", "text": prompt}]
             
             # Add screenshot if available
             if screenshot_data:
@@ -502,7 +1137,7 @@ class AIClient:
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
+                        "media_type": settings.get('image_mime_type', 'image/png'),
                         "data": screenshot_data
                     }
                 })
@@ -510,62 +1145,63 @@ class AIClient:
             
             data = {
                 "model": model,
-                "max_tokens": kwargs.get('max_tokens', 4000),
-                "temperature": kwargs.get('temperature', 0.1),
+                "max_tokens": settings.get('max_tokens', 4000),
+                "temperature": settings.get('temperature', 0.1),
                 "messages": [{"role": "user", "content": content}]
             }
             
-            # Add thinking budget for supported models
-            if any(x in model for x in ['claude-4', 'claude-3-7', 'claude-3.7']):
-                thinking_budget = getattr(addon_prefs, 'thinking_budget', 'auto')
-                if thinking_budget != 'auto':
-                    thinking_map = {
-                        'low': 2000,
-                        'medium': 8000, 
-                        'high': 32000,
-                        'max': 64000
-                    }
-                    if thinking_budget in thinking_map:
-                        data['max_completion_tokens'] = thinking_map[thinking_budget]
+            # Enable extended thinking for supported models. The budget counts against max_tokens,
+            # so the answer keeps its own allowance on top, within the model's output limit
+            thinking_budget = settings.get('thinking_budget', 'auto')
+            if thinking_budget in THINKING_BUDGET_TOKENS and model.startswith(ANTHROPIC_THINKING_PREFIXES):
+                output_cap = next(
+                    (cap for prefix, cap in ANTHROPIC_MAX_OUTPUT_TOKENS if model.startswith(prefix)), 32000
+                )
+                answer_tokens = data['max_tokens']
+                budget = max(
+                    ANTHROPIC_MIN_THINKING_TOKENS,
+                    min(THINKING_BUDGET_TOKENS[thinking_budget], output_cap - answer_tokens)
+                )
+                data['max_tokens'] = min(output_cap, budget + answer_tokens)
+                data['thinking'] = {"type": "enabled", "budget_tokens": budget}
+                # Thinking only runs at the default temperature
+                del data['temperature']
             
-            response = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=data, timeout=60)
-            response.raise_for_status()
+            on_delta = settings.get('on_delta')
+            if on_delta:
+                data["stream"] = True
             
-            result = response.json()
+            result = self._post_json(
+                "https://api.anthropic.com/v1/messages", headers, data, 'Anthropic',
+                on_delta=on_delta, extract=_anthropic_delta, compress=settings.get('compress_requests', False)
+            )
+            if on_delta:
+                return result
             
-            if 'content' in result and result['content']:
-                return result['content'][0]['text']
+            # With thinking enabled the first content block is the thinking, not the answer
+            text = next((block['text'] for block in result.get('content') or () if block.get('type') == 'text'), None)
+            if text is not None:
+                return text
             elif 'error' in result:
                 error_msg = result['error'].get('message', 'Unknown error')
                 raise AIBackendError(f"Anthropic API error: {error_msg}")
             else:
                 raise AIBackendError("Anthropic API returned no content in response")
                 
-        except requests.exceptions.Timeout:
-            raise AIBackendError("Anthropic API request timed out. Please try again.")
-        except requests.exceptions.ConnectionError:
-            raise AIBackendError("Failed to connect to Anthropic API. Check your internet connection.")
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 401:
-                raise AIBackendError("Invalid Anthropic API key. Please check your API key in preferences.")
-            elif e.response.status_code == 429:
-                raise AIBackendError("Anthropic API rate limit exceeded. Please wait and try again.")
-            elif e.response.status_code == 400:
-                raise AIBackendError("Invalid request to Anthropic API. Check your model selection and parameters.")
-            else:
-                raise AIBackendError(f"Anthropic API HTTP error {e.response.status_code}: {e.response.text}")
+        except AIBackendError:
+            raise
         except Exception as e:
             raise AIBackendError(f"Unexpected error calling Anthropic API: {str(e)}")
 
     def call_gemini(self, prompt, screenshot_data=None, **kwargs):
         """Call Google Gemini API with enhanced multimodal support"""
         try:
-            api_key = self.get_api_key()
+            settings = self.request_settings('gemini', **kwargs)
+            api_key = settings.get('api_key')
             if not api_key:
                 raise AIBackendError("Gemini API key not set in preferences")
                 
-            addon_prefs = bpy.context.preferences.addons[__package__].preferences
-            model = self.map_model_name(kwargs.get('model', addon_prefs.gemini_model), 'gemini')
+            model = self.map_model_name(settings['model'], 'gemini')
             
             # Build content parts - Gemini supports multimodal input
             parts = [{"text": prompt}]
@@ -574,7 +1210,7 @@ class AIClient:
             if screenshot_data:
                 parts.append({
                     "inline_data": {
-                        "mime_type": "image/png",
+                        "mime_type": settings.get('image_mime_type', 'image/png'),
                         "data": screenshot_data
                     }
                 })
@@ -583,30 +1219,30 @@ class AIClient:
             data = {
                 "contents": [{"parts": parts}],
                 "generationConfig": {
-                    "temperature": kwargs.get('temperature', 0.1),
-                    "maxOutputTokens": kwargs.get('max_tokens', 4000)
+                    "temperature": settings.get('temperature', 0.1),
+                    "maxOutputTokens": settings.get('max_tokens', 4000)
                 }
             }
             
             # Add thinking configuration for supported models
-            if any(x in model for x in ['2.5', '2.0']):
-                thinking_budget = getattr(addon_prefs, 'thinking_budget', 'auto')
+            if model.startswith(GEMINI_THINKING_PREFIXES):
+                thinking_budget = settings.get('thinking_budget', 'auto')
                 if thinking_budget != 'auto':
-                    thinking_map = {
-                        'low': 2000,
-                        'medium': 8000,
-                        'high': 32000, 
-                        'max': 64000
-                    }
-                    if thinking_budget in thinking_map:
-                        data['generationConfig']['maxOutputTokens'] = thinking_map[thinking_budget]
+                    if thinking_budget in THINKING_BUDGET_TOKENS:
+                        data['generationConfig']['maxOutputTokens'] = THINKING_BUDGET_TOKENS[thinking_budget]
             
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-            
-            response = requests.post(url, headers={"Content-Type": "application/json"}, json=data, timeout=60)
-            response.raise_for_status()
+            on_delta = settings.get('on_delta')
+            if on_delta:
+                url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+            else:
+                url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
             
-            result = response.json()
+            result = self._post_json(
+                url, {}, data, 'Gemini',
+                on_delta=on_delta, extract=_gemini_delta, compress=settings.get('compress_requests', False)
+            )
+            if on_delta:
+                return result
             
             # Enhanced error handling for Gemini responses
             if 'candidates' in result and result['candidates']:
@@ -621,59 +1257,40 @@ class AIClient:
             else:
                 raise AIBackendError("Gemini API returned no candidates in response")
                 
-        except requests.exceptions.Timeout:
-            raise AIBackendError("Gemini API request timed out. Please try again.")
-        except requests.exceptions.ConnectionError:
-            raise AIBackendError("Failed to connect to Gemini API. Check your internet connection.")
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 401:
-                raise AIBackendError("Invalid Gemini API key. Please check your API key in preferences.")
-            elif e.response.status_code == 429:
-                raise AIBackendError("Gemini API rate limit exceeded. Please wait and try again.")
-            elif e.response.status_code == 400:
-                try:
-                    error_detail = e.response.json()
-                    if 'error' in error_detail:
-                        error_msg = error_detail['error'].get('message', 'Bad request')
-                        raise AIBackendError(f"Gemini API error: {error_msg}")
-                except:
-                    pass
-                raise AIBackendError("Invalid request to Gemini API. Check your model selection and parameters.")
-            else:
-                raise AIBackendError(f"Gemini API HTTP error {e.response.status_code}: {e.response.text}")
+        except AIBackendError:
+            raise
         except Exception as e:
             raise AIBackendError(f"Unexpected error calling Gemini API: {str(e)}")
 
     def call_local(self, prompt, **kwargs):
         """Call local LLM server with enhanced error handling"""
         try:
-            addon_prefs = bpy.context.preferences.addons[__package__].preferences
-            api_url = addon_prefs.local_api_url
-            model_name = getattr(addon_prefs, 'local_model', 'local-model')
+            settings = self.request_settings('local', **kwargs)
+            api_url = settings.get('api_url')
+            model_name = settings['model']
             
             if not api_url:
                 raise AIBackendError("Local API URL not set in preferences")
             
-            headers = {"Content-Type": "application/json"}
-            
             data = {
                 "model": model_name,
                 "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": kwargs.get('max_tokens', 4000),
-                "temperature": kwargs.get('temperature', 0.1)
+                "max_tokens": settings.get('max_tokens', 4000),
+                "temperature": settings.get('temperature', 0.1)
             }
             
-            # Ensure URL ends with /chat/completions
-            if not api_url.endswith('/chat/completions'):
-                if api_url.endswith('/'):
-                    api_url += 'chat/completions'
-                else:
-                    api_url += '/chat/completions'
+            api_url = _chat_completions_url(api_url)
             
-            response = requests.post(api_url, headers=headers, json=data, timeout=120)  # Longer timeout for local
-            response.raise_for_status()
+            on_delta = settings.get('on_delta')
+            if on_delta:
+                data["stream"] = True
             
-            result = response.json()
+            result = self._post_json(
+                api_url, {}, data, 'Local', timeout=120,  # Longer timeout for local
+                on_delta=on_delta, extract=_openai_delta
+            )
+            if on_delta:
+                return result
             
             if 'choices' in result and result['choices']:
                 return result['choices'][0]['message']['content']
@@ -683,22 +1300,63 @@ class AIClient:
             else:
                 raise AIBackendError("Local API returned no choices in response")
                 
+        except AIBackendError:
+            raise
+        except Exception as e:
+            raise AIBackendError(f"Unexpected error calling local API: {str(e)}")
+
+    def _post_json(self, url, headers, payload, provider, timeout=60, on_delta=None, extract=None, compress=False):
+        """POST a JSON payload, mapping transport and HTTP failures to AIBackendError.
+
+        Returns the parsed response body, or the full streamed text when on_delta is given.
+        With compress=True large bodies are sent gzip-encoded.
+        """
+        messages = LOCAL_REQUEST_ERROR_MESSAGES if provider == 'Local' else REQUEST_ERROR_MESSAGES
+        body = _dumps(payload)
+        if compress and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=5)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        try:
+            response = self.post(url, headers=headers, data=body, timeout=timeout, stream=bool(on_delta))
+            response.raise_for_status()
+            if on_delta:
+                return _collect_stream(response, extract, on_delta)
+            return _loads(response.content)
         except requests.exceptions.Timeout:
-            raise AIBackendError("Local API request timed out. Check if your local server is running and responsive.")
+            raise AIBackendError(messages['timeout'].format(provider=provider))
         except requests.exceptions.ConnectionError:
-            raise AIBackendError(f"Failed to connect to local API at {api_url}. Check if your local server is running.")
+            raise AIBackendError(messages['connection'].format(provider=provider, url=url.split('?')[0]))
         except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                raise AIBackendError("Local API endpoint not found. Check your API URL configuration.")
-            elif e.response.status_code == 500:
-                raise AIBackendError("Local API server error. Check your local server logs.")
-            else:
-                raise AIBackendError(f"Local API HTTP error {e.response.status_code}: {e.response.text}")
-        except Exception as e:
-            raise AIBackendError(f"Unexpected error calling local API: {str(e)}")
+            status = e.response.status_code
+            if status == 400:
+                # Providers explain rejected requests in the body; surface that when present
+                try:
+                    error_msg = _loads(e.response.content)['error']['message']
+                except Exception:
+                    error_msg = None
+                if error_msg:
+                    raise AIBackendError(f"{provider} API error: {error_msg}")
+            if status in messages:
+                raise AIBackendError(messages[status].format(provider=provider))
+            raise AIBackendError(f"{provider} API HTTP error {status}: {e.response.text}")
 
-    def generate_code(self, user_request, backend=None, **kwargs):
-        """Enhanced code generation with comprehensive context and visual input"""
+    def post(self, url, **kwargs):
+        """POST through the shared session, retrying 429/5xx responses with jittered exponential backoff"""
+        for attempt in range(MAX_RETRIES + 1):
+            response = self.session.post(url, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+            delay = _retry_delay(response, attempt)
+            print(f"Warning: {url.split('?')[0]} returned {response.status_code}, retrying in {delay:.1f}s")
+            response.close()
+            time.sleep(delay)
+
+    def prepare_request(self, user_request, backend=None, use_cache=True, stream=False, **kwargs):
+        """Main-thread half of code generation: snapshot scene state, build prompt, resolve settings.
+
+        With stream=True the response text is appended to request['chunks'] as it arrives,
+        so the caller can poll it for partial output while the request runs.
+        """
         # Ensure backend consistency
         if backend:
             self.backend = backend
@@ -710,31 +1368,93 @@ class AIClient:
         self.store_scene_state()
         
         # Build enhanced prompt with context
-        prompt, screenshot_data = self.build_prompt(user_request)
+        prompt, screenshot_data = self.build_prompt(user_request, backend)
+        
+        settings = self.request_settings(backend, **kwargs)
+        
+        addon_prefs = get_addon_preferences()
+        settings.setdefault('compress_requests', addon_prefs.compress_requests)
+        semantic_scope = None
+        semantic_threshold = None
+        if use_cache:
+            use_cache = addon_prefs.enable_response_cache
+            if use_cache and addon_prefs.enable_semantic_cache:
+                # Only the user's wording is compared; the scene context (everything before the
+                # request marker) and whether a screenshot went along must match exactly
+                context_text = prompt.partition(PROMPT_REQUEST_MARKER)[0]
+                semantic_scope = self.response_cache.make_scope(
+                    backend, settings.get('model'), f"{context_text}|{bool(screenshot_data)}"
+                )
+                semantic_threshold = addon_prefs.semantic_cache_threshold
+        
+        return {
+            'backend': backend,
+            'user_request': user_request,
+            'prompt': prompt,
+            'screenshot_data': screenshot_data,
+            'settings': settings,
+            'use_cache': use_cache,
+            'semantic_scope': semantic_scope,
+            'semantic_threshold': semantic_threshold,
+            'stream': stream,
+            'chunks': [],
+            'keep_full_history': addon_prefs.keep_full_history
+        }
+
+    def run_request(self, request):
+        """Send a prepared request to its backend. Safe to call from a worker thread."""
+        backend = request['backend']
+        prompt = request['prompt']
+        screenshot_data = request['screenshot_data']
+        settings = request['settings']
+        image_mime_type = 'image/png'
+        shot = screenshot_data if isinstance(screenshot_data, ViewportShot) else None
+        
+        # Identical requests against an unchanged scene are answered from the on-disk cache.
+        # A capture is keyed by its content digest, so cache hits never encode the image
+        cache_key = self.response_cache.make_key(
+            backend, settings.get('model'), settings.get('temperature', 0.1),
+            settings.get('max_tokens', 4000), prompt, shot.digest if shot else screenshot_data
+        )
+        semantic_scope = request.get('semantic_scope')
+        if request.get('use_cache', True):
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is None and semantic_scope:
+                cached_response = self.response_cache.get_similar(
+                    semantic_scope, request['user_request'], request['semantic_threshold']
+                )
+            if cached_response is not None:
+                self.log_response(request, cached_response, cached=True)
+                return cached_response
+        
+        if shot is not None:
+            # Image and base64 encoding were deferred from build_prompt so they run here, off the UI thread
+            image_mime_type = shot.mime_type
+            screenshot_data = shot.encode()
+        
+        # list.append is atomic, so the main thread can read chunks while this worker fills it
+        on_delta = request['chunks'].append if request.get('stream') else None
         
         try:
             # Call appropriate backend with enhanced error handling
             if backend == 'openai':
-                response = self.call_openai(prompt, screenshot_data, **kwargs)
+                response = self.call_openai(prompt, screenshot_data, on_delta=on_delta, image_mime_type=image_mime_type, **settings)
             elif backend == 'anthropic':
-                response = self.call_anthropic(prompt, screenshot_data, **kwargs)
+                response = self.call_anthropic(prompt, screenshot_data, on_delta=on_delta, image_mime_type=image_mime_type, **settings)
             elif backend == 'gemini':
-                response = self.call_gemini(prompt, screenshot_data, **kwargs)
+                response = self.call_gemini(prompt, screenshot_data, on_delta=on_delta, image_mime_type=image_mime_type, **settings)
             elif backend == 'local':
-                response = self.call_local(prompt, **kwargs)
+                response = self.call_local(prompt, on_delta=on_delta, **settings)
             else:
                 raise AIBackendError(f"Unsupported backend '{backend}'. Available backends: openai, anthropic, gemini, local")
             
             # Log the interaction
-            self.response_log.append({
-                'timestamp': time.time(),
-                'backend': backend,
-                'user_request': user_request,
-                'response': response,
-                'has_screenshot': screenshot_data is not None,
-                'prompt_tokens': self.estimate_token_count(prompt),
-                'response_tokens': self.estimate_token_count(response)
-            })
+            self.log_response(request, response)
+            
+            if response:
+                self.response_cache.put(cache_key, response)
+                if semantic_scope:
+                    self.response_cache.put_similar(semantic_scope, request['user_request'], response)
             
             return response
             
@@ -748,9 +1468,72 @@ class AIClient:
             # Catch-all for unexpected errors
             raise AIBackendError(f"Unexpected error with {backend}: {str(e)}")
 
+    def log_response(self, request, response, cached=False):
+        """Record a completed request in the bounded response log"""
+        keep_full = request.get('keep_full_history')
+        user_request = request['user_request']
+        entry = {
+            'timestamp': time.time(),
+            'backend': request['backend'],
+            # Refinement requests embed the whole previous script, so they are capped like responses
+            'user_request': user_request if keep_full else user_request[:RESPONSE_LOG_MAX_CHARS],
+            'response': response if keep_full else response[:RESPONSE_LOG_MAX_CHARS],
+            'response_chars': len(response),
+            'has_screenshot': request['screenshot_data'] is not None,
+            # build_prompt already counted this text, so it comes from the token count cache
+            'prompt_tokens': self.estimate_token_count(request['prompt'])
+        }
+        if cached:
+            entry['cached'] = True
+        self.response_log.append(entry)
+
+    def generate_code(self, user_request, backend=None, **kwargs):
+        """Enhanced code generation with comprehensive context and visual input (blocking)"""
+        return self.run_request(self.prepare_request(user_request, backend, **kwargs))
+
+    async def agenerate_code(self, request):
+        """Coroutine running a prepared request without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.run_request, request)
+
+    def generate_code_async(self, user_request, backend=None, **kwargs):
+        """Start code generation on the background loop and return a concurrent.futures.Future.
+
+        Prompt building reads bpy and therefore happens here on the calling (main) thread;
+        only the network round trip runs in the background.
+        """
+        return self.submit_request(self.prepare_request(user_request, backend, **kwargs))
+
+    def submit_request(self, request):
+        """Run a prepared request on the background loop and return a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(self.agenerate_code(request), get_event_loop())
+
+    async def agenerate_batch(self, prepared_requests, max_concurrency=10):
+        """Run several prepared requests concurrently, bounded to respect provider rate limits.
+
+        Results keep the input order; a failed request yields its exception instead of a string.
+        """
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run(request):
+            async with semaphore:
+                return await self.agenerate_code(request)
+
+        return await asyncio.gather(*(run(request) for request in prepared_requests), return_exceptions=True)
+
+    def generate_code_compare(self, user_request, backends=('openai', 'anthropic', 'gemini', 'local'), **kwargs):
+        """Send one request to several backends at once and return a concurrent.futures.Future.
+
+        The result lists each backend's code (or exception) in the order given; the scene
+        snapshot and screenshot are captured once and shared by all of them.
+        """
+        prepared = [self.prepare_request(user_request, backend, **kwargs) for backend in backends]
+        return asyncio.run_coroutine_threadsafe(self.agenerate_batch(prepared, len(prepared)), get_event_loop())
+
     def get_conversation_history(self, limit=5):
         """Get recent conversation history"""
-        recent_logs = self.response_log[-limit:] if self.response_log else []
+        # deque has no slicing; walk back from the newest entry instead
+        recent_logs = list(islice(reversed(self.response_log), limit))[::-1]
         history = []
         
         for log in recent_logs:
@@ -764,3 +1547,21 @@ class AIClient:
             
         return history
 
+    def close(self):
+        """Release pooled connections, the cache database, the GPU offscreen buffer and the screenshot file"""
+        if self._offscreen is not None:
+            self._offscreen.free()
+            self._offscreen = None
+        self.close_at_exit()
+
+    def close_at_exit(self):
+        """close() minus the GPU buffer, which may already be gone when the interpreter exits"""
+        self.session.close()
+        self.response_cache.close()
+        self._last_shot = None
+        if self._screenshot_path is not None:
+            try:
+                os.remove(self._screenshot_path)
+            except OSError:
+                pass
+            self._screenshot_path = None
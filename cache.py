@@ -0,0 +1,241 @@
+import bpy
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from collections import OrderedDict
+
+# Cached responses older than this are ignored and purged on startup
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Recent responses also kept in memory so repeat hits skip SQLite and decompression
+MEMORY_CACHE_SIZE = 128
+
+# Size of the hashed feature vectors used for semantic lookups
+EMBEDDING_DIM = 512
+
+# Semantic entries kept per scope; older ones are evicted so lookups stay one small matmul
+SEMANTIC_MAX_ENTRIES = 512
+
+# Stored in PRAGMA user_version; bump when a table layout or key format changes.
+# 2: responses keyed by raw SHA256 digests in a BLOB column (was hex TEXT)
+# 3: semantic entries carry the request's word signature
+CACHE_SCHEMA_VERSION = 3
+
+def request_words(text):
+    """Lowercase word and number tokens of a request, the same tokens embed_text starts from"""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def request_signature(text):
+    """Sorted word multiset of a request, numbers included.
+
+    Semantic hits must match it exactly: the trigram embedding scores "move it up 2 meters"
+    and "move it up 5 meters" as near-identical, so only word order, case and punctuation
+    are left for the similarity threshold to forgive.
+    """
+    return " ".join(sorted(request_words(text)))
+
+def embed_text(text):
+    """Cheap local embedding: hashed word and character-trigram counts, L2-normalized.
+
+    Runs without any model download; good enough to match rephrasings that share most
+    of their wording, which is the common case when iterating on a prompt.
+    """
+    normalized = " ".join(request_words(text))
+    features = normalized.split() + [normalized[i:i + 3] for i in range(len(normalized) - 2)]
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature in features:
+        # blake2b rather than hash(): embeddings are persisted, so the hash must be stable across sessions
+        index = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=4).digest(), 'little')
+        vector[index % EMBEDDING_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def get_cache_dir():
+    """Directory under Blender's user config where BlendAI keeps its caches"""
+    return bpy.utils.user_resource('CONFIG', path="blendai", create=True)
+
+class ResponseCache:
+    """On-disk cache of AI responses keyed by a SHA256 of the full request"""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL_SECONDS):
+        # Resolve the path up front: lookups may later run on a worker thread where bpy is off limits
+        if path is None:
+            try:
+                path = os.path.join(get_cache_dir(), "response_cache.sqlite3")
+            except Exception as e:
+                print(f"Warning: Could not resolve response cache directory: {e}")
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (response, ts)
+
+    @staticmethod
+    def make_key(backend, model, temperature, max_tokens, prompt, screenshot_data=None):
+        """Deterministic key covering everything that influences the response.
+
+        screenshot_data may be the encoded image or any bytes identifying it, such as a content digest.
+        """
+        digest = hashlib.sha256(f"{backend}|{model}|{temperature}|{max_tokens}".encode('utf-8'))
+        digest.update(prompt.encode('utf-8'))
+        if isinstance(screenshot_data, str):
+            screenshot_data = screenshot_data.encode('utf-8')
+        digest.update(screenshot_data or b"")
+        # Raw 32 bytes: half the size of the hex form in both the table and its index
+        return digest.digest()
+
+    @staticmethod
+    def make_scope(backend, model, context_text):
+        """Key for semantic lookups: only prompts sharing backend, model and scene context are compared"""
+        return hashlib.sha256(f"{backend}|{model}|{context_text}".encode('utf-8')).hexdigest()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL appends instead of rewriting pages through a rollback journal, and NORMAL only
+            # fsyncs at checkpoints; a crash can lose the newest entries, which is fine for a cache
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            # Entries written under an older layout can never be hit again; start those tables over
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < CACHE_SCHEMA_VERSION:
+                if version < 2:
+                    self._conn.execute("DROP TABLE IF EXISTS responses")
+                if version < 3:
+                    self._conn.execute("DROP TABLE IF EXISTS semantic")
+                self._conn.execute(f"PRAGMA user_version = {CACHE_SCHEMA_VERSION}")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key BLOB PRIMARY KEY, response BLOB, ts INTEGER)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS semantic "
+                "(id INTEGER PRIMARY KEY, scope TEXT, signature TEXT, embedding BLOB, response BLOB, ts INTEGER)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS semantic_lookup ON semantic (scope, signature)")
+            # Drop expired entries once per session rather than on every lookup
+            cutoff = int(time.time() - self.ttl)
+            self._conn.execute("DELETE FROM responses WHERE ts < ?", (cutoff,))
+            self._conn.execute("DELETE FROM semantic WHERE ts < ?", (cutoff,))
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, key, response, ts):
+        """Add to the in-memory LRU; caller holds the lock"""
+        self._memory[key] = (response, ts)
+        self._memory.move_to_end(key)
+        if len(self._memory) > MEMORY_CACHE_SIZE:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss"""
+        if not self.path:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] >= time.time() - self.ttl:
+                self._memory.move_to_end(key)
+                return entry[0]
+            try:
+                row = self._connect().execute(
+                    "SELECT response, ts FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"Warning: Response cache lookup failed: {e}")
+                return None
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        response = zlib.decompress(row[0]).decode('utf-8')
+        with self._lock:
+            self._remember(key, response, row[1])
+        return response
+
+    def put(self, key, response):
+        """Store a response, replacing any previous entry for key"""
+        if not self.path:
+            return
+        blob = zlib.compress(response.encode('utf-8'))
+        with self._lock:
+            self._remember(key, response, int(time.time()))
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, ts) VALUES (?, ?, ?)",
+                    (key, blob, int(time.time()))
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: Response cache write failed: {e}")
+
+    def get_similar(self, scope, text, threshold):
+        """Return the cached response whose request is most similar to text, if above threshold.
+
+        Only entries with the same word signature (see request_signature) are candidates.
+        """
+        if not self.path:
+            return None
+        with self._lock:
+            try:
+                rows = self._connect().execute(
+                    "SELECT embedding, response FROM semantic WHERE scope = ? AND signature = ? AND ts >= ?",
+                    (scope, request_signature(text), int(time.time() - self.ttl))
+                ).fetchall()
+            except sqlite3.Error as e:
+                print(f"Warning: Semantic cache lookup failed: {e}")
+                return None
+        if not rows:
+            return None
+        
+        # Embeddings are stored normalized, so cosine similarity is a single matrix-vector product
+        matrix = np.frombuffer(b"".join(row[0] for row in rows), dtype=np.float32).reshape(len(rows), EMBEDDING_DIM)
+        scores = matrix @ embed_text(text)
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        return zlib.decompress(rows[best][1]).decode('utf-8')
+
+    def put_similar(self, scope, text, response):
+        """Store a response for semantic lookups"""
+        if not self.path:
+            return
+        embedding = embed_text(text).tobytes()
+        blob = zlib.compress(response.encode('utf-8'))
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT INTO semantic (scope, signature, embedding, response, ts) VALUES (?, ?, ?, ?, ?)",
+                    (scope, request_signature(text), embedding, blob, int(time.time()))
+                )
+                conn.execute(
+                    "DELETE FROM semantic WHERE scope = ? AND id NOT IN "
+                    "(SELECT id FROM semantic WHERE scope = ? ORDER BY id DESC LIMIT ?)",
+                    (scope, scope, SEMANTIC_MAX_ENTRIES)
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: Semantic cache write failed: {e}")
+
+    def clear(self):
+        """Remove every cached response"""
+        if not self.path:
+            return
+        with self._lock:
+            self._memory.clear()
+            try:
+                conn = self._connect()
+                conn.execute("DELETE FROM responses")
+                conn.execute("DELETE FROM semantic")
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: Could not clear response cache: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -4,31 +4,155 @@ import traceback
 import builtins
 import ast
 import signal
-import threading
+import time
+import types
 from io import StringIO
 from contextlib import contextmanager
 
+# Only allow these modules and builtins!
+# To add more modules safely:
+# 1. Ensure the module doesn't provide file system access
+# 2. Ensure it doesn't allow arbitrary code execution
+# 3. Test thoroughly in a safe environment first
+# 4. Add to this set and update documentation
+ALLOWED_MODULES = frozenset({
+    'bpy', 'bmesh', 'mathutils', 'math', 'random',
+    'numpy', 'json', 're', 'time', 'datetime'
+})
+ALLOWED_BUILTINS = frozenset({
+    'abs', 'all', 'any', 'bin', 'bool', 'callable', 'chr', 'complex', 'dict', 'dir', 'divmod',
+    'enumerate', 'filter', 'float', 'format', 'frozenset', 'getattr', 'hasattr', 'hash', 'hex',
+    'id', 'int', 'isinstance', 'issubclass', 'iter', 'len', 'list', 'map', 'max', 'min', 'next',
+    'object', 'oct', 'ord', 'pow', 'print', 'range', 'repr', 'reversed', 'round', 'set', 'slice',
+    'sorted', 'str', 'sum', 'tuple', 'type', 'zip'
+})
+
+# Validation results and code objects kept for re-run snippets, keyed by the full source text
+VALIDATION_CACHE_SIZE = 64
+
+class UnsafeCode(Exception):
+    """Raised by _SafetyVisitor at the first disallowed construct"""
+    pass
+
+class _ExecutionTimeout(BaseException):
+    """Raised inside running code at the deadline; not an Exception, so generated code's
+    `except Exception` blocks can't swallow it (CPython drops the tracer after it raises)"""
+    pass
+
+def _reraise_timeout(error):
+    """Called first in every except handler of generated code (see _TimeoutReraiser)"""
+    if isinstance(error, _ExecutionTimeout):
+        raise error
+
+# Globals the rewritten handlers refer to; generated code never names them itself
+TIMEOUT_GLOBALS = {
+    '_blendai_reraise_timeout': _reraise_timeout,
+    '_blendai_any_error': BaseException,
+}
+TIMEOUT_HANDLER_NAME = '_blendai_error'
+
+class _TimeoutReraiser(ast.NodeTransformer):
+    """Start every except handler with a re-raise of _ExecutionTimeout.
+
+    Bare, tuple, aliased and BaseException handlers would otherwise swallow the timeout, and
+    the tracer is gone once it has raised, so a runaway loop around them would never stop.
+    """
+    
+    def visit_ExceptHandler(self, node):
+        self.generic_visit(node)
+        if node.name is None:
+            if node.type is None:
+                # A bare except needs a type to bind the error to a name
+                node.type = ast.Name(id='_blendai_any_error', ctx=ast.Load())
+            node.name = TIMEOUT_HANDLER_NAME
+        node.body.insert(0, ast.Expr(ast.Call(
+            func=ast.Name(id='_blendai_reraise_timeout', ctx=ast.Load()),
+            args=[ast.Name(id=node.name, ctx=ast.Load())],
+            keywords=[]
+        )))
+        return node
+
+class _SafetyVisitor(ast.NodeVisitor):
+    """Single pass over the AST; NodeVisitor dispatches on node type, so each node gets only its own checks"""
+    
+    # Additional dangerous patterns to check
+    DANGEROUS_NAMES = frozenset({
+        'exec', 'eval', 'compile', 'open', 'input', 'raw_input', '__import__',
+        'globals', 'locals', 'vars', 'dir', 'delattr', 'setattr'
+    })
+    
+    # Check for potential obfuscation patterns
+    SUSPICIOUS_PATTERNS = frozenset({
+        'getattr', 'hasattr', 'setattr', 'delattr'  # Could be used to access dangerous attributes
+    })
+    
+    # Block all import statements
+    def visit_Import(self, node):
+        raise UnsafeCode("Imports are not allowed!")
+    
+    visit_ImportFrom = visit_Import
+    
+    # Block dangerous function calls
+    def visit_Call(self, node):
+        if isinstance(node.func, ast.Name):
+            if node.func.id in self.DANGEROUS_NAMES:
+                raise UnsafeCode(f"Usage of dangerous function '{node.func.id}' detected!")
+            # Allow basic usage of suspicious patterns but block if used with string literals that look suspicious
+            if node.func.id in self.SUSPICIOUS_PATTERNS and node.args and isinstance(node.args[0], ast.Constant):
+                if isinstance(node.args[0].value, str) and node.args[0].value.startswith('__'):
+                    raise UnsafeCode(f"Suspicious usage of '{node.func.id}' with dunder attribute detected!")
+        self.generic_visit(node)
+    
+    # Block access to dunder attributes
+    def visit_Attribute(self, node):
+        if node.attr.startswith("__"):
+            raise UnsafeCode(f"Access to dunder attribute '{node.attr}' is not allowed!")
+        self.generic_visit(node)
+    
+    # Block global/locals manipulation
+    def visit_Global(self, node):
+        raise UnsafeCode("Global and nonlocal declarations are not allowed!")
+    
+    visit_Nonlocal = visit_Global
+    
+    # Block while True loops (common infinite loop pattern)
+    def visit_While(self, node):
+        if isinstance(node.test, ast.Constant) and node.test.value is True:
+            raise UnsafeCode("Infinite 'while True' loops are not allowed for safety!")
+        self.generic_visit(node)
+
 class CodeExecutor:
     def __init__(self):
-        # Only allow these modules and builtins!
-        # To add more modules safely:
-        # 1. Ensure the module doesn't provide file system access
-        # 2. Ensure it doesn't allow arbitrary code execution
-        # 3. Test thoroughly in a safe environment first
-        # 4. Add to this set and update documentation
-        self.allowed_modules = {
-            'bpy', 'bmesh', 'mathutils', 'math', 'random',
-            'numpy', 'json', 're', 'time', 'datetime'
-        }
-        self.allowed_builtins = {
-            'abs', 'all', 'any', 'bin', 'bool', 'callable', 'chr', 'complex', 'dict', 'dir', 'divmod',
-            'enumerate', 'filter', 'float', 'format', 'frozenset', 'getattr', 'hasattr', 'hash', 'hex',
-            'id', 'int', 'isinstance', 'issubclass', 'iter', 'len', 'list', 'map', 'max', 'min', 'next',
-            'object', 'oct', 'ord', 'pow', 'print', 'range', 'repr', 'reversed', 'round', 'set', 'slice',
-            'sorted', 'str', 'sum', 'tuple', 'type', 'zip'
-        }
+        self.allowed_modules = ALLOWED_MODULES
+        self.allowed_builtins = ALLOWED_BUILTINS
         # Execution timeout in seconds (helps prevent infinite loops)
         self.execution_timeout = 30
+        self._validation_cache = {}
+        self._code_cache = {}  # source -> rewritten tree (see _TimeoutReraiser), replaced by its code object on first run
+        self._globals_template = None
+        # execute_code only runs on Blender's main thread, so one capture buffer can be reused
+        self._stdout_buffer = StringIO()
+
+    def _get_globals_template(self):
+        """Restricted globals, built on first execution rather than at add-on load; callers copy it"""
+        if self._globals_template is None:
+            self._globals_template = {
+                'bpy': bpy,
+                'bmesh': __import__('bmesh'),
+                'mathutils': __import__('mathutils'),
+                'math': __import__('math'),
+                'random': __import__('random'),
+                'json': __import__('json'),
+                're': __import__('re'),
+                'time': __import__('time'),
+                'datetime': __import__('datetime'),
+                # Helper function for safe object access
+                'safe_access': self.safe_object_access,
+                **TIMEOUT_GLOBALS,
+                # Only allow these builtins!
+                '__builtins__': {k: getattr(builtins, k) for k in self.allowed_builtins}
+            }
+        return self._globals_template
 
     def validate_code(self, code):
         """
@@ -36,68 +160,53 @@ class CodeExecutor:
         Enhanced validation with additional security checks.
         Returns (is_safe: bool, message: str)
         """
+        # Re-running the same generated snippet skips parsing and the tree walk
+        cached = self._validation_cache.get(code)
+        if cached is not None:
+            return cached
+        
         try:
             tree = ast.parse(code, mode='exec')
         except Exception as ex:
             return False, f"Code could not be parsed: {ex}"
 
-        # Additional dangerous patterns to check
-        dangerous_names = {
-            'exec', 'eval', 'compile', 'open', 'input', 'raw_input', '__import__',
-            'globals', 'locals', 'vars', 'dir', 'delattr', 'setattr'
-        }
+        try:
+            _SafetyVisitor().visit(tree)
+        except UnsafeCode as ex:
+            result = (False, str(ex))
+        else:
+            # All checks passed
+            result = (True, "Code appears safe")
         
-        # Check for potential obfuscation patterns
-        suspicious_patterns = {
-            'getattr', 'hasattr', 'setattr', 'delattr'  # Could be used to access dangerous attributes
-        }
-
-        for node in ast.walk(tree):
-            # Block all import statements
-            if isinstance(node, (ast.Import, ast.ImportFrom)):
-                return False, "Imports are not allowed!"
-            
-            # Block dangerous function calls
-            if isinstance(node, ast.Call):
-                if isinstance(node.func, ast.Name):
-                    if node.func.id in dangerous_names:
-                        return False, f"Usage of dangerous function '{node.func.id}' detected!"
-                    # Warn about suspicious patterns that could be used for obfuscation
-                    if node.func.id in suspicious_patterns:
-                        # Allow basic usage but block if used with string literals that look suspicious
-                        if isinstance(node.args[0] if node.args else None, ast.Constant):
-                            if isinstance(node.args[0].value, str) and node.args[0].value.startswith('__'):
-                                return False, f"Suspicious usage of '{node.func.id}' with dunder attribute detected!"
-            
-            # Block access to dunder attributes
-            if isinstance(node, ast.Attribute):
-                if node.attr.startswith("__"):
-                    return False, f"Access to dunder attribute '{node.attr}' is not allowed!"
-            
-            # Block global/locals manipulation
-            if isinstance(node, (ast.Global, ast.Nonlocal)):
-                return False, "Global and nonlocal declarations are not allowed!"
-            
-            # Block while True loops (common infinite loop pattern)
-            if isinstance(node, ast.While):
-                if isinstance(node.test, ast.Constant) and node.test.value is True:
-                    return False, "Infinite 'while True' loops are not allowed for safety!"
-
-        # All checks passed
-        return True, "Code appears safe"
+        if len(self._validation_cache) >= VALIDATION_CACHE_SIZE:
+            self._validation_cache.clear()
+            self._code_cache.clear()
+        self._validation_cache[code] = result
+        if result[0]:
+            self._code_cache[code] = ast.fix_missing_locations(_TimeoutReraiser().visit(tree))
+        return result
 
     @contextmanager
     def timeout_context(self, timeout_seconds):
-        """Context manager for execution timeout (basic implementation)"""
-        def timeout_handler():
-            raise TimeoutError(f"Code execution timed out after {timeout_seconds} seconds")
+        """Context manager for execution timeout.
+
+        A trace function checks the deadline on every executed line of Python in this thread,
+        so _ExecutionTimeout is raised inside the running code itself. Time spent in a single
+        long C call (e.g. one heavy bpy operator) is only noticed once it returns.
+        """
+        deadline = time.monotonic() + timeout_seconds
+        
+        def deadline_trace(frame, event, arg):
+            if time.monotonic() > deadline:
+                raise _ExecutionTimeout(f"Code execution timed out after {timeout_seconds} seconds")
+            return deadline_trace
         
-        timer = threading.Timer(timeout_seconds, timeout_handler)
-        timer.start()
+        previous_trace = sys.gettrace()
+        sys.settrace(deadline_trace)
         try:
             yield
         finally:
-            timer.cancel()
+            sys.settrace(previous_trace)
     
     def safe_object_access(self, obj, attr_name, default=None):
         """Safely access object attributes with proper error handling"""
@@ -118,40 +227,38 @@ class CodeExecutor:
         if not is_safe:
             return False, message, ""
 
-        # Step 2: Prepare restricted globals with safe object access helper
-        exec_globals = {
-            'bpy': bpy,
-            'bmesh': __import__('bmesh'),
-            'mathutils': __import__('mathutils'),
-            'math': __import__('math'),
-            'random': __import__('random'),
-            'json': __import__('json'),
-            're': __import__('re'),
-            'time': __import__('time'),
-            'datetime': __import__('datetime'),
-            # Helper function for safe object access
-            'safe_access': self.safe_object_access,
-            # Only allow these builtins!
-            '__builtins__': {k: getattr(builtins, k) for k in self.allowed_builtins}
-        }
+        # Step 2: Prepare restricted globals with safe object access helper; the builtins are
+        # copied too so one snippet can't change them for the next
+        template = self._get_globals_template()
+        exec_globals = template.copy()
+        exec_globals['__builtins__'] = template['__builtins__'].copy()
 
         # Step 3: Set up undo step (push undo for safety)
         bpy.ops.ed.undo_push(message="AI Code Execution")
 
         # Step 4: Capture stdout (for print output)
         old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
+        sys.stdout = captured_output = self._stdout_buffer
 
         try:
+            # Compile once per snippet, from the tree validation already parsed
+            code_object = self._code_cache.get(code)
+            if not isinstance(code_object, types.CodeType):
+                if code_object is None:
+                    # Never run the raw source: it would miss the timeout re-raise in its handlers
+                    code_object = ast.fix_missing_locations(_TimeoutReraiser().visit(ast.parse(code, mode='exec')))
+                code_object = compile(code_object, "<blendai>", "exec")
+                self._code_cache[code] = code_object
+            
             # Step 5: Execute with timeout protection
             with self.timeout_context(self.execution_timeout):
-                exec(code, exec_globals)
+                exec(code_object, exec_globals)
             
             output = captured_output.getvalue()
             bpy.context.view_layer.update()
             return True, "Code executed successfully.", output
             
-        except TimeoutError as ex:
+        except _ExecutionTimeout as ex:
             # Handle timeout specifically
             bpy.ops.ed.undo()
             return False, f"Code execution timed out: {ex}", captured_output.getvalue()
@@ -170,6 +277,9 @@ class CodeExecutor:
             return False, f"Error during code execution: {error_msg}\n\n{tb}", captured_output.getvalue()
         finally:
             sys.stdout = old_stdout
+            # Output has been read above; empty the buffer for the next run
+            captured_output.seek(0)
+            captured_output.truncate()
 
 
 # DOCUMENTATION: How to Safely Add More Allowed Modules
@@ -177,7 +287,7 @@ class CodeExecutor:
 # 
 # To expand the allowed modules for AI-generated code execution:
 # 
-# 1. Add the module name to the exec_globals dictionary in execute_code():
+# 1. Add the module name to the dictionary in CodeExecutor._get_globals_template():
 #    'new_module': __import__('new_module'),
 # 
 # 2. Consider security implications:
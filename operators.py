@@ -1,134 +1,325 @@
 import bpy
-import datetime
-from .ai_client import AIClient
+import atexit
+from bpy.app.handlers import persistent
+import re
+import time
+from collections import deque
+from .ai_client import AIClient, register_handlers, unregister_handlers, shutdown_event_loop
 from .code_executor import CodeExecutor
+from .preferences import get_addon_preferences, get_pref, API_KEY_ATTR
 
 # You may want these as singletons in __init__.py, but we'll instantiate here for clarity
 ai_client = AIClient()
 code_executor = CodeExecutor()
 
+# Backend failure kinds in priority order. Each branch is a lookahead over the whole message,
+# so one match classifies it and the first listed kind wins wherever it appears
+BACKEND_ERROR_PATTERN = re.compile(
+    r"^(?:(?=.*((?-i:API key)))|(?=.*(quota|billing))|(?=.*(timeout))|(?=.*(connection)))",
+    re.IGNORECASE | re.DOTALL
+)
+# Report template per pattern group; index 0 is for errors matching none of them
+BACKEND_ERROR_MESSAGES = (
+    "❌ AI Error: {}",
+    "❌ API Key Error: {}",
+    "💳 Billing/Quota Error: {}",
+    "⏱️ Request timed out. Please try again.",
+    "🌐 Connection error. Check your internet connection.",
+)
+
+# Output log entries; the scene property is rebuilt from these instead of growing by +=
+OUTPUT_LOG_MAX_ENTRIES = 200
+# Once the log is full, entries arriving faster than this (e.g. an error loop) are counted, not written
+OUTPUT_LOG_MIN_INTERVAL = 0.01
+_output_entries = deque(maxlen=OUTPUT_LOG_MAX_ENTRIES)
+_output_text = None
+_output_last_time = 0.0
+_output_suppressed = 0
+
+def append_output(scene, text):
+    """Append text to scene.ai_last_output, keeping only the newest OUTPUT_LOG_MAX_ENTRIES entries"""
+    global _output_text, _output_last_time, _output_suppressed
+    now = time.monotonic()
+    if len(_output_entries) == OUTPUT_LOG_MAX_ENTRIES and now - _output_last_time < OUTPUT_LOG_MIN_INTERVAL:
+        _output_suppressed += 1
+        return
+    _output_last_time = now
+    
+    current = scene.ai_last_output
+    if current != _output_text:
+        # Cleared, another scene, or a loaded file: continue from what the property holds
+        _output_entries.clear()
+        if current:
+            _output_entries.append(current)
+    if _output_suppressed:
+        _output_entries.append(f"[{_output_suppressed} messages suppressed]\n")
+        _output_suppressed = 0
+    _output_entries.append(text)
+    _output_text = "".join(_output_entries)
+    scene.ai_last_output = _output_text
+
+_timestamp_second = None
+_timestamp_text = ""
+
+def log_timestamp():
+    """HH:MM:SS for log lines; formatted once per wall-clock second and reused within it"""
+    global _timestamp_second, _timestamp_text
+    now = int(time.time())
+    if now != _timestamp_second:
+        _timestamp_second = now
+        _timestamp_text = time.strftime("%H:%M:%S", time.localtime(now))
+    return _timestamp_text
+
+def is_blank(text):
+    """True for None, empty or whitespace-only text; isspace() checks without copying like strip() would"""
+    return not text or text.isspace()
+
+def truncate(text, limit):
+    """text cut to limit characters with '...' appended, or unchanged if it already fits"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+def tag_sidebar_redraw(context):
+    """Redraw the 3D View sidebars showing BlendAI state, without redrawing the viewports themselves.
+
+    Modal operators change scene properties from timer events, which don't redraw the UI
+    on their own; tagging the whole area would re-render the 3D viewport as well.
+    """
+    screen = context.screen
+    if screen is None:
+        return
+    for area in screen.areas:
+        if area.type == 'VIEW_3D':
+            for region in area.regions:
+                if region.type == 'UI':
+                    region.tag_redraw()
+
+def output_log_enabled():
+    """Whether status lines should be formatted and written to ai_last_output at all"""
+    return get_pref('enable_output_log')
+
+def report_backend_error(operator, error_msg):
+    """Report a failed AI request with a message matching its cause"""
+    match = BACKEND_ERROR_PATTERN.match(error_msg)
+    kind = match.lastindex if match else 0
+    operator.report({'ERROR'}, BACKEND_ERROR_MESSAGES[kind].format(error_msg))
+
 class AI_OT_GenerateCode(bpy.types.Operator):
     """Generate Python code from a natural prompt using AI"""
     bl_idname = "ai.generate_code"
     bl_label = "Generate AI Python Code"
     bl_options = {'REGISTER', 'UNDO'}
 
-    def execute(self, context):
+    use_cache: bpy.props.BoolProperty(
+        name="Use Cache",
+        description="Allow answering from the response cache",
+        default=True,
+        options={'HIDDEN', 'SKIP_SAVE'}
+    )
+
+    # Shared with AI_OT_CancelGeneration; only one generation polls at a time
+    _running = False
+    _cancel_requested = False
+
+    _timer = None
+    _future = None
+
+    def _begin(self, context):
+        """Validate input and log the start of a generation. Returns request kwargs or None."""
         scene = context.scene
         prompt = scene.ai_prompt
 
         # Ensure prompt exists
-        if not prompt or not prompt.strip():
+        if is_blank(prompt):
             self.report({'ERROR'}, "Please enter a prompt.")
-            return {'CANCELLED'}
+            return None
 
         # Get AI provider from preferences
-        addon_prefs = context.preferences.addons[__package__].preferences
+        addon_prefs = get_addon_preferences()
         provider = addon_prefs.ai_provider
         
         # Check if API key is configured for the selected provider
-        api_key = None
-        if provider == 'openai':
-            api_key = addon_prefs.openai_api_key
-        elif provider == 'anthropic':
-            api_key = addon_prefs.anthropic_api_key
-        elif provider == 'gemini':
-            api_key = addon_prefs.gemini_api_key
-        # Local doesn't need API key
-        
-        if provider != 'local' and (not api_key or not api_key.strip()):
+        api_key = addon_prefs.provider_api_key(provider)  # Local doesn't need API key
+        
+        if provider != 'local' and is_blank(api_key):
             self.report({'ERROR'}, f"Please configure your {provider.upper()} API key in preferences.")
-            return {'CANCELLED'}
+            return None
 
-        try:
-            # Set generation status
-            scene.ai_is_generating = True
-            
-            # Set AI client backend
-            ai_client.backend = provider
-            
-            # Get model name for the selected provider
-            model_name = "Unknown"
-            model_param = None
-            if provider == 'openai':
-                model_name = addon_prefs.openai_model
-                model_param = model_name
-            elif provider == 'anthropic':
-                model_name = addon_prefs.anthropic_model
-                model_param = model_name
-            elif provider == 'gemini':
-                model_name = addon_prefs.gemini_model
-                model_param = model_name
-            elif provider == 'local':
-                model_name = addon_prefs.local_model
-                model_param = model_name
-            
-            # Log generation start
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            log_entry = f"[{timestamp}] GENERATION STARTED: {provider.upper()} ({model_name})\nPrompt: {prompt[:100]}{'...' if len(prompt) > 100 else ''}\n"
-            if hasattr(scene, 'ai_last_output'):
-                scene.ai_last_output += log_entry + "\n"
-            
-            # Generate code using AI with model parameter
-            self.report({'INFO'}, f"🤖 Generating code using {provider.upper()} ({model_name})...")
-            generated_code = ai_client.generate_code(prompt, backend=provider, model=model_param)
-            
-            # Clear generation status
-            scene.ai_is_generating = False
-            
-            if not generated_code or not generated_code.strip():
-                # Log failure
-                timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        # Set generation status
+        scene.ai_is_generating = True
+        
+        # Set AI client backend
+        ai_client.backend = provider
+        
+        # Get model name for the selected provider
+        model_param = addon_prefs.provider_model(provider)
+        model_name = model_param or "Unknown"
+        
+        # Log generation start
+        if output_log_enabled():
+            timestamp = log_timestamp()
+            log_entry = f"[{timestamp}] GENERATION STARTED: {provider.upper()} ({model_name})\nPrompt: {truncate(prompt, 100)}\n"
+            append_output(scene, log_entry + "\n")
+        
+        self._provider = provider
+        self._model_name = model_name
+        self.report({'INFO'}, f"🤖 Generating code using {provider.upper()} ({model_name})...")
+        return {'user_request': prompt, 'backend': provider, 'model': model_param, 'use_cache': self.use_cache}
+
+    def _finish(self, context, generated_code):
+        """Store a completed generation and optionally auto-execute it"""
+        scene = context.scene
+        provider = self._provider
+        model_name = self._model_name
+        addon_prefs = get_addon_preferences()
+        
+        # Clear generation status
+        scene.ai_is_generating = False
+        
+        if is_blank(generated_code):
+            # Log failure
+            if output_log_enabled():
+                timestamp = log_timestamp()
                 log_entry = f"[{timestamp}] GENERATION FAILED: Empty code returned\n"
-                if hasattr(scene, 'ai_last_output'):
-                    scene.ai_last_output += log_entry + "\n"
-                
-                self.report({'ERROR'}, "AI generated empty code. Please try rephrasing your prompt.")
-                return {'CANCELLED'}
+                append_output(scene, log_entry + "\n")
             
-            # Store the generated code in scene
-            scene.ai_generated_code = generated_code
-            
-            # Log success
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+            self.report({'ERROR'}, "AI generated empty code. Please try rephrasing your prompt.")
+            return {'CANCELLED'}
+        
+        # Store the generated code in scene
+        scene.ai_generated_code = generated_code
+        
+        # Log success
+        if output_log_enabled():
+            timestamp = log_timestamp()
             log_entry = f"[{timestamp}] GENERATION SUCCESS: {len(generated_code)} characters generated\n"
-            if hasattr(scene, 'ai_last_output'):
-                scene.ai_last_output += log_entry + "\n"
-            
-            self.report({'INFO'}, f"✅ Code generated successfully using {provider.upper()} ({model_name})")
-            
-            # Auto-execute if enabled in preferences
-            if hasattr(addon_prefs, 'auto_execute_code') and addon_prefs.auto_execute_code:
-                return bpy.ops.ai.execute_code()
-            
-            return {'FINISHED'}
+            append_output(scene, log_entry + "\n")
+        
+        self.report({'INFO'}, f"✅ Code generated successfully using {provider.upper()} ({model_name})")
+        
+        # Auto-execute if enabled in preferences; execute() only needs report(), so this
+        # operator runs it directly instead of dispatching a nested bpy.ops call
+        if getattr(addon_prefs, 'auto_execute_code', False):
+            return AI_OT_ExecuteCode.execute(self, context)
+        
+        return {'FINISHED'}
 
-        except Exception as e:
-            # Clear generation status on error
-            scene.ai_is_generating = False
-            
-            error_msg = str(e)
-            
-            # Log the error
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+    def _fail(self, context, e):
+        """Log and report a failed generation"""
+        scene = context.scene
+        
+        # Clear generation status on error
+        scene.ai_is_generating = False
+        
+        error_msg = str(e)
+        
+        # Log the error
+        if output_log_enabled():
+            timestamp = log_timestamp()
             log_entry = f"[{timestamp}] GENERATION ERROR: {error_msg}\n"
-            if hasattr(scene, 'ai_last_output'):
-                scene.ai_last_output += log_entry + "\n"
-            
-            # Provide more specific error messages
-            if "API key" in error_msg:
-                self.report({'ERROR'}, f"❌ API Key Error: {error_msg}")
-            elif "quota" in error_msg.lower() or "billing" in error_msg.lower():
-                self.report({'ERROR'}, f"💳 Billing/Quota Error: {error_msg}")
-            elif "timeout" in error_msg.lower():
-                self.report({'ERROR'}, "⏱️ Request timed out. Please try again.")
-            elif "connection" in error_msg.lower():
-                self.report({'ERROR'}, "🌐 Connection error. Check your internet connection.")
-            else:
-                self.report({'ERROR'}, f"❌ AI Error: {error_msg}")
-            
+            append_output(scene, log_entry + "\n")
+        
+        # Provide more specific error messages
+        report_backend_error(self, error_msg)
+        
+        return {'CANCELLED'}
+
+    def execute(self, context):
+        # Blocking path, used when the operator is called from scripts
+        request = self._begin(context)
+        if request is None:
+            return {'CANCELLED'}
+
+        try:
+            generated_code = ai_client.generate_code(**request)
+        except Exception as e:
+            return self._fail(context, e)
+        return self._finish(context, generated_code)
+
+    def invoke(self, context, event):
+        # Interactive path: the network call runs on the background loop while we poll
+        request = self._begin(context)
+        if request is None:
+            return {'CANCELLED'}
+
+        addon_prefs = get_addon_preferences()
+        try:
+            self._request = ai_client.prepare_request(
+                stream=addon_prefs.enable_streaming, **request
+            )
+            self._future = ai_client.submit_request(self._request)
+        except Exception as e:
+            return self._fail(context, e)
+
+        # Partial output overwrites the code buffer, so keep the old code to restore on failure
+        self._previous_code = context.scene.ai_generated_code
+        self._chunks_shown = 0
+
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        # The request length is unknown, so the cursor progress counter just cycles while it runs
+        self._started = time.monotonic()
+        wm.progress_begin(0, 100)
+        wm.modal_handler_add(self)
+        AI_OT_GenerateCode._running = True
+        AI_OT_GenerateCode._cancel_requested = False
+        return {'RUNNING_MODAL'}
+
+    def _stop_polling(self, context):
+        """Remove the poll timer and the cursor progress indicator"""
+        AI_OT_GenerateCode._running = False
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        self._timer = None
+        wm.progress_end()
+        tag_sidebar_redraw(context)
+
+    def modal(self, context, event):
+        if event.type != 'TIMER':
+            # Every other event belongs to the user's work in the rest of the window
+            return {'PASS_THROUGH'}
+
+        if AI_OT_GenerateCode._cancel_requested:
+            # The request already on the wire finishes in the background; its result is dropped
+            self._future.cancel()
+            self._stop_polling(context)
+            context.scene.ai_generated_code = self._previous_code
+            context.scene.ai_is_generating = False
+            self.report({'WARNING'}, "Generation cancelled")
             return {'CANCELLED'}
 
+        if not self._future.done():
+            context.window_manager.progress_update(int((time.monotonic() - self._started) * 5) % 100)
+            # Show streamed text as it arrives
+            chunks = self._request['chunks']
+            if len(chunks) != self._chunks_shown:
+                self._chunks_shown = len(chunks)
+                context.scene.ai_generated_code = "".join(chunks[:self._chunks_shown])
+                tag_sidebar_redraw(context)
+            return {'PASS_THROUGH'}
+
+        self._stop_polling(context)
+        try:
+            generated_code = self._future.result()
+        except Exception as e:
+            context.scene.ai_generated_code = self._previous_code
+            return self._fail(context, e)
+        return self._finish(context, generated_code)
+
+class AI_OT_CancelGeneration(bpy.types.Operator):
+    """Stop waiting for the code being generated and keep the previous code"""
+    bl_idname = "ai.cancel_generation"
+    bl_label = "Cancel Generation"
+    bl_options = {'REGISTER'}
+
+    @classmethod
+    def poll(cls, context):
+        return AI_OT_GenerateCode._running
+
+    def execute(self, context):
+        # Picked up by the generation's next poll timer tick
+        AI_OT_GenerateCode._cancel_requested = True
+        return {'FINISHED'}
+
 class AI_OT_ExecuteCode(bpy.types.Operator):
     """Execute the generated AI code safely"""
     bl_idname = "ai.execute_code"
@@ -136,10 +327,11 @@ class AI_OT_ExecuteCode(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
+        # Also called unbound by the generate operators for auto-execute: use only self.report here
         scene = context.scene
         code = scene.ai_generated_code
 
-        if not code or not code.strip():
+        if is_blank(code):
             self.report({'ERROR'}, "No code to execute. Generate code first.")
             return {'CANCELLED'}
 
@@ -149,23 +341,22 @@ class AI_OT_ExecuteCode(bpy.types.Operator):
             success, message, output = code_executor.execute_code(code)
             
             # Log the execution output
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            log_entry = f"[{timestamp}] Execution {'SUCCESS' if success else 'FAILED'}\n"
-            if output:
-                log_entry += f"Output: {output}\n"
-            if message:
-                log_entry += f"Message: {message}\n"
-            
-            # Append to existing logs
-            if hasattr(scene, 'ai_last_output'):
-                scene.ai_last_output += log_entry + "\n"
+            if output_log_enabled():
+                timestamp = log_timestamp()
+                log_entry = f"[{timestamp}] Execution {'SUCCESS' if success else 'FAILED'}\n"
+                if output:
+                    log_entry += f"Output: {output}\n"
+                if message:
+                    log_entry += f"Message: {message}\n"
+                
+                # Append to existing logs
+                append_output(scene, log_entry + "\n")
             
             if success:
                 self.report({'INFO'}, "✅ Code executed successfully!")
                 
                 # Show diff summary if enabled
-                addon_prefs = context.preferences.addons[__package__].preferences
-                if addon_prefs.enable_diff_summary:
+                if get_pref('enable_diff_summary'):
                     diff_summary = ai_client.get_diff_summary()
                     if diff_summary and diff_summary != "No significant changes detected.":
                         # Store diff summary for display in UI
@@ -187,10 +378,10 @@ class AI_OT_ExecuteCode(bpy.types.Operator):
         except Exception as e:
             error_msg = str(e)
             # Log the error
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            log_entry = f"[{timestamp}] EXCEPTION: {error_msg}\n"
-            if hasattr(scene, 'ai_last_output'):
-                scene.ai_last_output += log_entry + "\n"
+            if output_log_enabled():
+                timestamp = log_timestamp()
+                log_entry = f"[{timestamp}] EXCEPTION: {error_msg}\n"
+                append_output(scene, log_entry + "\n")
             
             self.report({'ERROR'}, f"❌ Execution error: {error_msg}")
             return {'CANCELLED'}
@@ -220,12 +411,9 @@ class AI_OT_ClearAll(bpy.types.Operator):
         scene.ai_generated_code = ""
         scene.ai_diff_summary = ""
         scene.ai_prompt = ""
-        if hasattr(scene, 'ai_last_output'):
-            scene.ai_last_output = ""
-        if hasattr(scene, 'ai_refine_feedback'):
-            scene.ai_refine_feedback = ""
-        if hasattr(scene, 'ai_show_refine_input'):
-            scene.ai_show_refine_input = False
+        scene.ai_last_output = ""
+        scene.ai_refine_feedback = ""
+        scene.ai_show_refine_input = False
         self.report({'INFO'}, "🧹 Cleared all AI data")
         return {'FINISHED'}
 
@@ -237,8 +425,7 @@ class AI_OT_ClearOutput(bpy.types.Operator):
 
     def execute(self, context):
         scene = context.scene
-        if hasattr(scene, 'ai_last_output'):
-            scene.ai_last_output = ""
+        scene.ai_last_output = ""
         self.report({'INFO'}, "🧹 Cleared output logs")
         return {'FINISHED'}
 
@@ -269,7 +456,7 @@ class AI_OT_ApplyRefine(bpy.types.Operator):
     def execute(self, context):
         scene = context.scene
         
-        if not hasattr(scene, 'ai_refine_feedback') or not scene.ai_refine_feedback.strip():
+        if is_blank(scene.ai_refine_feedback):
             self.report({'ERROR'}, "Please provide refinement feedback")
             return {'CANCELLED'}
         
@@ -279,7 +466,8 @@ class AI_OT_ApplyRefine(bpy.types.Operator):
         # Hide the refine input
         scene.ai_show_refine_input = False
         
-        # Call the refine code operator with the feedback
+        # Call the refine code operator with the feedback; this stays an operator call because
+        # the refinement runs as its own modal operator instance
         bpy.ops.ai.refine_code('INVOKE_DEFAULT', feedback=feedback)
         
         # Clear the feedback
@@ -296,8 +484,7 @@ class AI_OT_CancelRefine(bpy.types.Operator):
     def execute(self, context):
         scene = context.scene
         scene.ai_show_refine_input = False
-        if hasattr(scene, 'ai_refine_feedback'):
-            scene.ai_refine_feedback = ""
+        scene.ai_refine_feedback = ""
         self.report({'INFO'}, "❌ Cancelled refinement")
         return {'FINISHED'}
 
@@ -313,82 +500,111 @@ class AI_OT_RefineCode(bpy.types.Operator):
         default=""
     )
 
+    _timer = None
+    _future = None
+
+    def _begin(self, context):
+        """Validate input and build the refinement request kwargs, or return None"""
+        scene = context.scene
+        # Each read of a string property copies it out of Blender; the script can be long
+        code = scene.ai_generated_code
+        
+        if is_blank(code):
+            self.report({'ERROR'}, "No code to refine. Generate code first.")
+            return None
+        
+        if is_blank(self.feedback):
+            self.report({'ERROR'}, "Please provide feedback for refinement.")
+            return None
+
+        # Get AI provider from preferences
+        addon_prefs = get_addon_preferences()
+        provider = addon_prefs.ai_provider
+        
+        # Create refinement prompt
+        refinement_prompt = (
+            f"The previous code generated was:\n```python\n{code}\n```\n\n"
+            f"User feedback: {self.feedback}\n\n"
+            f"Please generate improved code that addresses this feedback. "
+            f"Original request: {scene.ai_prompt}"
+        )
+        
+        # Set AI client backend
+        ai_client.backend = provider
+        
+        # Get model name for the selected provider
+        model_param = addon_prefs.provider_model(provider)
+        model_name = model_param or "Unknown"
+        
+        self.report({'INFO'}, f"🔄 Refining code using {provider.upper()} ({model_name})...")
+        return {'user_request': refinement_prompt, 'backend': provider, 'model': model_param}
+
+    def _finish(self, context, refined_code):
+        """Store the refined code"""
+        if is_blank(refined_code):
+            self.report({'ERROR'}, "AI generated empty refined code.")
+            return {'CANCELLED'}
+        
+        # Update the generated code
+        context.scene.ai_generated_code = refined_code
+        
+        self.report({'INFO'}, "✅ Code refined successfully!")
+        return {'FINISHED'}
+
     def invoke(self, context, event):
         scene = context.scene
         
-        # If feedback is provided (from apply_refine), use it directly
+        # If feedback is provided (from apply_refine), refine in the background like generate does
         if self.feedback:
-            return self.execute(context)
+            request = self._begin(context)
+            if request is None:
+                return {'CANCELLED'}
+            try:
+                self._future = ai_client.submit_request(ai_client.prepare_request(**request))
+            except Exception as e:
+                self.report({'ERROR'}, f"❌ Refinement failed: {str(e)}")
+                return {'CANCELLED'}
+            
+            wm = context.window_manager
+            self._timer = wm.event_timer_add(0.1, window=context.window)
+            wm.modal_handler_add(self)
+            return {'RUNNING_MODAL'}
         
         # Otherwise, show the refine input UI in the panel
         scene.ai_show_refine_input = True
         self.report({'INFO'}, "💬 Enter refinement feedback in the panel below")
         return {'FINISHED'}
 
+    def modal(self, context, event):
+        if event.type != 'TIMER' or not self._future.done():
+            return {'PASS_THROUGH'}
+
+        context.window_manager.event_timer_remove(self._timer)
+        self._timer = None
+        tag_sidebar_redraw(context)
+        try:
+            refined_code = self._future.result()
+        except Exception as e:
+            self.report({'ERROR'}, f"❌ Refinement failed: {str(e)}")
+            return {'CANCELLED'}
+        return self._finish(context, refined_code)
+
     def draw(self, context):
         layout = self.layout
         layout.prop(self, "feedback")
 
     def execute(self, context):
-        scene = context.scene
-        
-        if not scene.ai_generated_code or not scene.ai_generated_code.strip():
-            self.report({'ERROR'}, "No code to refine. Generate code first.")
-            return {'CANCELLED'}
-        
-        if not self.feedback or not self.feedback.strip():
-            self.report({'ERROR'}, "Please provide feedback for refinement.")
+        # Blocking path, used when the operator is called from scripts
+        request = self._begin(context)
+        if request is None:
             return {'CANCELLED'}
 
         try:
-            # Get AI provider from preferences
-            addon_prefs = context.preferences.addons[__package__].preferences
-            provider = addon_prefs.ai_provider
-            
-            # Create refinement prompt
-            refinement_prompt = (
-                f"The previous code generated was:\n```python\n{scene.ai_generated_code}\n```\n\n"
-                f"User feedback: {self.feedback}\n\n"
-                f"Please generate improved code that addresses this feedback. "
-                f"Original request: {scene.ai_prompt}"
-            )
-            
-            # Set AI client backend
-            ai_client.backend = provider
-            
-            # Get model name for the selected provider
-            model_name = "Unknown"
-            model_param = None
-            if provider == 'openai':
-                model_name = addon_prefs.openai_model
-                model_param = model_name
-            elif provider == 'anthropic':
-                model_name = addon_prefs.anthropic_model
-                model_param = model_name
-            elif provider == 'gemini':
-                model_name = addon_prefs.gemini_model
-                model_param = model_name
-            elif provider == 'local':
-                model_name = addon_prefs.local_model
-                model_param = model_name
-            
-            # Generate refined code
-            self.report({'INFO'}, f"🔄 Refining code using {provider.upper()} ({model_name})...")
-            refined_code = ai_client.generate_code(refinement_prompt, backend=provider, model=model_param)
-            
-            if not refined_code or not refined_code.strip():
-                self.report({'ERROR'}, "AI generated empty refined code.")
-                return {'CANCELLED'}
-            
-            # Update the generated code
-            scene.ai_generated_code = refined_code
-            
-            self.report({'INFO'}, "✅ Code refined successfully!")
-            return {'FINISHED'}
-
+            refined_code = ai_client.generate_code(**request)
         except Exception as e:
             self.report({'ERROR'}, f"❌ Refinement failed: {str(e)}")
             return {'CANCELLED'}
+        return self._finish(context, refined_code)
 
 class AI_OT_SaveCode(bpy.types.Operator):
     """Save the generated code to a .py file"""
@@ -411,20 +627,24 @@ class AI_OT_SaveCode(bpy.types.Operator):
         scene = context.scene
         code = scene.ai_generated_code
 
-        if not code or not code.strip():
+        if is_blank(code):
             self.report({'ERROR'}, "No code to save. Generate code first.")
             return {'CANCELLED'}
 
+        filepath = self.filepath
+        # Header comment and code go out as one string in a single write
+        payload = (
+            "# BlendAI Generated Code\n"
+            f"# Prompt: {scene.ai_prompt}\n"
+            "# Generated by BlendAI addon\n\n"
+            "import bpy\n\n"
+            f"{code}"
+        )
         try:
-            with open(self.filepath, 'w', encoding='utf-8') as f:
-                # Add header comment
-                f.write("# BlendAI Generated Code\n")
-                f.write(f"# Prompt: {scene.ai_prompt}\n")
-                f.write("# Generated by BlendAI addon\n\n")
-                f.write("import bpy\n\n")
-                f.write(code)
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(payload)
             
-            self.report({'INFO'}, f"💾 Code saved to: {self.filepath}")
+            self.report({'INFO'}, f"💾 Code saved to: {filepath}")
             return {'FINISHED'}
 
         except Exception as e:
@@ -441,7 +661,7 @@ class AI_OT_CopyCode(bpy.types.Operator):
         scene = context.scene
         code = scene.ai_generated_code
 
-        if not code or not code.strip():
+        if is_blank(code):
             self.report({'ERROR'}, "No code to copy. Generate code first.")
             return {'CANCELLED'}
 
@@ -461,29 +681,31 @@ class AI_OT_RegenerateCode(bpy.types.Operator):
     bl_label = "Regenerate"
     bl_options = {'REGISTER', 'UNDO'}
 
+    def invoke(self, context, event):
+        if is_blank(context.scene.ai_prompt):
+            self.report({'ERROR'}, "No prompt to regenerate from. Enter a prompt first.")
+            return {'CANCELLED'}
+        # Run through the non-blocking generate path; skip the cache to get a fresh answer
+        result = bpy.ops.ai.generate_code('INVOKE_DEFAULT', use_cache=False)
+        # The modal handler belongs to the generate operator; this one is done once it started
+        return {'FINISHED'} if 'RUNNING_MODAL' in result else result
+
     def execute(self, context):
         scene = context.scene
         prompt = scene.ai_prompt
 
-        if not prompt or not prompt.strip():
+        if is_blank(prompt):
             self.report({'ERROR'}, "No prompt to regenerate from. Enter a prompt first.")
             return {'CANCELLED'}
 
         # Get AI provider from preferences
-        addon_prefs = context.preferences.addons[__package__].preferences
+        addon_prefs = get_addon_preferences()
         provider = addon_prefs.ai_provider
         
         # Check if API key is configured for the selected provider
-        api_key = None
-        if provider == 'openai':
-            api_key = addon_prefs.openai_api_key
-        elif provider == 'anthropic':
-            api_key = addon_prefs.anthropic_api_key
-        elif provider == 'gemini':
-            api_key = addon_prefs.gemini_api_key
-        # Local doesn't need API key
-        
-        if provider != 'local' and (not api_key or not api_key.strip()):
+        api_key = addon_prefs.provider_api_key(provider)  # Local doesn't need API key
+        
+        if provider != 'local' and is_blank(api_key):
             self.report({'ERROR'}, f"Please configure your {provider.upper()} API key in preferences.")
             return {'CANCELLED'}
 
@@ -492,26 +714,15 @@ class AI_OT_RegenerateCode(bpy.types.Operator):
             ai_client.backend = provider
             
             # Get model name for the selected provider
-            model_name = "Unknown"
-            model_param = None
-            if provider == 'openai':
-                model_name = addon_prefs.openai_model
-                model_param = model_name
-            elif provider == 'anthropic':
-                model_name = addon_prefs.anthropic_model
-                model_param = model_name
-            elif provider == 'gemini':
-                model_name = addon_prefs.gemini_model
-                model_param = model_name
-            elif provider == 'local':
-                model_name = addon_prefs.local_model
-                model_param = model_name
+            model_param = addon_prefs.provider_model(provider)
+            model_name = model_param or "Unknown"
             
             # Regenerate code using AI with model parameter
             self.report({'INFO'}, f"🔄 Regenerating code using {provider.upper()} ({model_name})...")
-            generated_code = ai_client.generate_code(prompt, backend=provider, model=model_param)
+            # Skip the response cache: regenerating should ask the provider for a fresh answer
+            generated_code = ai_client.generate_code(prompt, backend=provider, model=model_param, use_cache=False)
             
-            if not generated_code or not generated_code.strip():
+            if is_blank(generated_code):
                 self.report({'ERROR'}, "AI generated empty code. Please try rephrasing your prompt.")
                 return {'CANCELLED'}
             
@@ -521,8 +732,8 @@ class AI_OT_RegenerateCode(bpy.types.Operator):
             self.report({'INFO'}, f"🔄 Code regenerated successfully using {provider.upper()} ({model_name})")
             
             # Auto-execute if enabled in preferences
-            if hasattr(addon_prefs, 'auto_execute_code') and addon_prefs.auto_execute_code:
-                return bpy.ops.ai.execute_code()
+            if getattr(addon_prefs, 'auto_execute_code', False):
+                return AI_OT_ExecuteCode.execute(self, context)
             
             return {'FINISHED'}
 
@@ -530,79 +741,130 @@ class AI_OT_RegenerateCode(bpy.types.Operator):
             error_msg = str(e)
             
             # Provide more specific error messages
-            if "API key" in error_msg:
-                self.report({'ERROR'}, f"❌ API Key Error: {error_msg}")
-            elif "quota" in error_msg.lower() or "billing" in error_msg.lower():
-                self.report({'ERROR'}, f"💳 Billing/Quota Error: {error_msg}")
-            elif "timeout" in error_msg.lower():
-                self.report({'ERROR'}, "⏱️ Request timed out. Please try again.")
-            elif "connection" in error_msg.lower():
-                self.report({'ERROR'}, "🌐 Connection error. Check your internet connection.")
-            else:
-                self.report({'ERROR'}, f"❌ AI Error: {error_msg}")
+            report_backend_error(self, error_msg)
             
             return {'CANCELLED'}
 
 # Register scene properties
-def register_properties():
-    bpy.types.Scene.ai_prompt = bpy.props.StringProperty(
+# Long text properties and the flag mirroring whether each is non-empty. Panels poll the
+# flags, since reading the text itself copies the whole string on every redraw.
+CONTENT_FLAGS = {
+    'ai_generated_code': 'ai_has_code',
+    'ai_last_output': 'ai_has_output',
+    'ai_diff_summary': 'ai_has_diff',
+}
+
+def _content_updater(text_name, flag_name):
+    """update= callback keeping flag_name in sync with text_name on every write"""
+    def update(scene, context):
+        setattr(scene, flag_name, bool(getattr(scene, text_name)))
+    return update
+
+def _code_stats(code):
+    """Statistics label shown under the generated code"""
+    if not code:
+        return ""
+    # Counting newlines avoids building a list of every line
+    num_lines = code.count('\n') + 1
+    return f"📏 {num_lines} lines, {len(code)} characters"
+
+def _on_code_update(scene, context):
+    # The code panel draws the stored label instead of scanning the script on every redraw
+    code = scene.ai_generated_code
+    scene.ai_has_code = bool(code)
+    scene.ai_code_stats = _code_stats(code)
+
+@persistent
+def _sync_content_flags(*args):
+    """Set the flags for files saved before they existed, whose texts were never written since"""
+    for scene in bpy.data.scenes:
+        for text_name, flag_name in CONTENT_FLAGS.items():
+            has_content = bool(getattr(scene, text_name))
+            if getattr(scene, flag_name) != has_content:
+                setattr(scene, flag_name, has_content)
+        stats = _code_stats(scene.ai_generated_code)
+        if scene.ai_code_stats != stats:
+            scene.ai_code_stats = stats
+
+# Scene properties the add-on stores its state in; registered and removed together
+SCENE_PROPERTIES = {
+    'ai_prompt': bpy.props.StringProperty(
         name="AI Prompt",
         description="Describe what you want to create or modify in Blender",
         default="",
         maxlen=1000
-    )
-    
-    bpy.types.Scene.ai_generated_code = bpy.props.StringProperty(
+    ),
+    'ai_generated_code': bpy.props.StringProperty(
         name="Generated Code",
         description="AI-generated Python code",
-        default=""
-    )
-    
-    bpy.types.Scene.ai_diff_summary = bpy.props.StringProperty(
+        default="",
+        update=_on_code_update
+    ),
+    'ai_diff_summary': bpy.props.StringProperty(
         name="Diff Summary",
         description="Summary of changes made to the scene",
-        default=""
-    )
-    
-    bpy.types.Scene.ai_last_output = bpy.props.StringProperty(
+        default="",
+        update=_content_updater('ai_diff_summary', 'ai_has_diff')
+    ),
+    'ai_last_output': bpy.props.StringProperty(
         name="Last Output",
         description="Last execution output and logs",
-        default=""
-    )
-    
-    bpy.types.Scene.ai_refine_feedback = bpy.props.StringProperty(
+        default="",
+        update=_content_updater('ai_last_output', 'ai_has_output')
+    ),
+    'ai_refine_feedback': bpy.props.StringProperty(
         name="Refine Feedback",
         description="User feedback for code refinement",
         default=""
-    )
-    
-    bpy.types.Scene.ai_show_refine_input = bpy.props.BoolProperty(
+    ),
+    'ai_show_refine_input': bpy.props.BoolProperty(
         name="Show Refine Input",
         description="Whether to show the refine input UI",
         default=False
-    )
-    
-    bpy.types.Scene.ai_is_generating = bpy.props.BoolProperty(
+    ),
+    'ai_is_generating': bpy.props.BoolProperty(
         name="AI Is Generating",
         description="Whether AI is currently generating code",
         default=False
-    )
-    
-    bpy.types.Scene.ai_show_model_info = bpy.props.BoolProperty(
+    ),
+    'ai_show_model_info': bpy.props.BoolProperty(
         name="Show Model Info",
         description="Whether to show model recommendations",
         default=False
+    ),
+    'ai_has_code': bpy.props.BoolProperty(
+        name="Has Code",
+        description="Whether there is generated code (kept in sync with it)",
+        default=False
+    ),
+    'ai_code_stats': bpy.props.StringProperty(
+        name="Code Statistics",
+        description="Line and character count of the generated code (kept in sync with it)",
+        default=""
+    ),
+    'ai_has_output': bpy.props.BoolProperty(
+        name="Has Output",
+        description="Whether the output log has entries (kept in sync with it)",
+        default=False
+    ),
+    'ai_has_diff': bpy.props.BoolProperty(
+        name="Has Diff",
+        description="Whether there is a change summary (kept in sync with it)",
+        default=False
     )
+}
+
+def register_properties():
+    for name, prop in SCENE_PROPERTIES.items():
+        setattr(bpy.types.Scene, name, prop)
+    if _sync_content_flags not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(_sync_content_flags)
 
 def unregister_properties():
-    del bpy.types.Scene.ai_prompt
-    del bpy.types.Scene.ai_generated_code
-    del bpy.types.Scene.ai_diff_summary
-    del bpy.types.Scene.ai_last_output
-    del bpy.types.Scene.ai_refine_feedback
-    del bpy.types.Scene.ai_show_refine_input
-    del bpy.types.Scene.ai_is_generating
-    del bpy.types.Scene.ai_show_model_info
+    if _sync_content_flags in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(_sync_content_flags)
+    for name in SCENE_PROPERTIES:
+        delattr(bpy.types.Scene, name)
 
 class AI_OT_TestConnection(bpy.types.Operator):
     """Test the connection to the selected AI provider"""
@@ -610,55 +872,170 @@ class AI_OT_TestConnection(bpy.types.Operator):
     bl_label = "Test AI Connection"
     bl_options = {'REGISTER'}
 
-    def execute(self, context):
+    all_providers: bpy.props.BoolProperty(
+        name="All Providers",
+        description="Test every provider with an API key at once instead of only the selected one",
+        default=False,
+        options={'SKIP_SAVE'}
+    )
+
+    # Create a simple test prompt
+    test_prompt = "Reply with exactly: 'Connection successful'"
+
+    _timer = None
+    _future = None
+    _backends = None
+
+    def _begin(self, context):
+        """Mark the test as running and return the request kwargs"""
         scene = context.scene
-        prefs = context.preferences.addons[__name__.split('.')[0]].preferences
+        prefs = get_addon_preferences()
         
         # Set generating status
         scene.ai_is_generating = True
         
+        if self.all_providers:
+            # Local servers need no key, so they are only included when selected
+            self._backends = [
+                provider for provider in API_KEY_ATTR
+                if provider == prefs.ai_provider or not is_blank(prefs.provider_api_key(provider))
+            ]
+            if prefs.ai_provider not in self._backends:
+                self._backends.append(prefs.ai_provider)
+        else:
+            self._backends = [prefs.ai_provider]
+        
         # Log test start
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        scene.ai_last_output += f"[{timestamp}] Testing connection to {prefs.ai_provider}...\n"
+        self._timestamp = log_timestamp()
+        if output_log_enabled():
+            append_output(scene, f"[{self._timestamp}] Testing connection to {', '.join(self._backends)}...\n")
         
-        try:
-            # Create a simple test prompt
-            test_prompt = "Reply with exactly: 'Connection successful'"
-            
-            # Get the AI client and test
-            response = ai_client.generate_code(test_prompt, context)
-            
+        if len(self._backends) > 1:
+            # Each backend resolves its own model from preferences
+            return {'user_request': self.test_prompt, 'backends': self._backends, 'use_cache': False}
+        return {
+            'user_request': self.test_prompt, 'backend': prefs.ai_provider,
+            'model': prefs.provider_model(), 'use_cache': False
+        }
+
+    def _finish(self, context, response=None, error=None):
+        """Log and report the test outcome"""
+        scene = context.scene
+        timestamp = self._timestamp
+        log_enabled = output_log_enabled()
+        
+        # Clear generating status
+        scene.ai_is_generating = False
+        
+        if error is None:
             if response and "successful" in response.lower():
-                scene.ai_last_output += f"[{timestamp}] ✅ Connection test passed\n"
+                if log_enabled:
+                    append_output(scene, f"[{timestamp}] ✅ Connection test passed\n")
                 self.report({'INFO'}, "Connection test successful")
             else:
-                scene.ai_last_output += f"[{timestamp}] ⚠️ Connection established but unexpected response\n"
+                if log_enabled:
+                    append_output(scene, f"[{timestamp}] ⚠️ Connection established but unexpected response\n")
                 self.report({'WARNING'}, "Connection established but response was unexpected")
-                
-        except Exception as e:
-            timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-            error_msg = str(e)
-            scene.ai_last_output += f"[{timestamp}] ❌ Connection test failed: {error_msg}\n"
-            
-            # Provide helpful error messages
-            if "api key" in error_msg.lower():
-                self.report({'ERROR'}, "Invalid API key. Please check your configuration.")
-            elif "network" in error_msg.lower() or "connection" in error_msg.lower():
-                self.report({'ERROR'}, "Network error. Check your internet connection.")
-            elif "quota" in error_msg.lower() or "billing" in error_msg.lower():
-                self.report({'ERROR'}, "API quota exceeded or billing issue.")
+            return {'FINISHED'}
+        
+        error_msg = str(error)
+        if log_enabled:
+            append_output(scene, f"[{log_timestamp()}] ❌ Connection test failed: {error_msg}\n")
+        
+        # Provide helpful error messages
+        lowered = error_msg.lower()
+        if "api key" in lowered:
+            self.report({'ERROR'}, "Invalid API key. Please check your configuration.")
+        elif "network" in lowered or "connection" in lowered:
+            self.report({'ERROR'}, "Network error. Check your internet connection.")
+        elif "quota" in lowered or "billing" in lowered:
+            self.report({'ERROR'}, "API quota exceeded or billing issue.")
+        else:
+            self.report({'ERROR'}, f"Connection failed: {error_msg}")
+        return {'FINISHED'}
+
+    def _finish_all(self, context, results):
+        """Log each provider's outcome from a concurrent test and report how many passed"""
+        scene = context.scene
+        scene.ai_is_generating = False
+        log_enabled = output_log_enabled()
+        timestamp = log_timestamp()
+        
+        passed = []
+        for backend, result in zip(self._backends, results):
+            if isinstance(result, Exception):
+                line = f"❌ {backend.upper()}: {result}"
+            elif result and "successful" in result.lower():
+                passed.append(backend.upper())
+                line = f"✅ {backend.upper()}: passed"
             else:
-                self.report({'ERROR'}, f"Connection failed: {error_msg}")
+                line = f"⚠️ {backend.upper()}: unexpected response"
+            if log_enabled:
+                append_output(scene, f"[{timestamp}] {line}\n")
         
-        finally:
-            # Clear generating status
-            scene.ai_is_generating = False
-            
+        summary = f"Connection test: {len(passed)}/{len(self._backends)} providers passed"
+        if passed:
+            summary += f" ({', '.join(passed)})"
+        self.report({'INFO'} if len(passed) == len(self._backends) else {'WARNING'}, summary)
         return {'FINISHED'}
 
+    def _submit(self, request):
+        """Start the test on the background loop; several providers are queried concurrently"""
+        if 'backends' in request:
+            return ai_client.generate_code_compare(**request)
+        return ai_client.generate_code_async(**request)
+
+    def _complete(self, context, future):
+        """Finish from a completed future"""
+        try:
+            response = future.result()
+        except Exception as e:
+            return self._finish(context, error=e)
+        if len(self._backends) > 1:
+            return self._finish_all(context, response)
+        return self._finish(context, response)
+
+    def execute(self, context):
+        # Blocking path, used when the operator is called from scripts
+        request = self._begin(context)
+        if 'backends' in request:
+            try:
+                future = ai_client.generate_code_compare(**request)
+            except Exception as e:
+                return self._finish(context, error=e)
+            return self._complete(context, future)
+        try:
+            response = ai_client.generate_code(**request)
+        except Exception as e:
+            return self._finish(context, error=e)
+        return self._finish(context, response)
+
+    def invoke(self, context, event):
+        # Interactive path: poll the background request so the UI stays responsive
+        request = self._begin(context)
+        try:
+            self._future = self._submit(request)
+        except Exception as e:
+            return self._finish(context, error=e)
+        
+        wm = context.window_manager
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal(self, context, event):
+        if event.type != 'TIMER' or not self._future.done():
+            return {'PASS_THROUGH'}
+        
+        context.window_manager.event_timer_remove(self._timer)
+        self._timer = None
+        tag_sidebar_redraw(context)
+        return self._complete(context, self._future)
+
 # Classes to register
 classes = [
     AI_OT_GenerateCode,
+    AI_OT_CancelGeneration,
     AI_OT_ExecuteCode,
     AI_OT_ClearCode,
     AI_OT_ClearAll,
@@ -673,13 +1050,21 @@ classes = [
     AI_OT_TestConnection,
 ]
 
+_register_classes, _unregister_classes = bpy.utils.register_classes_factory(classes)
+
 def register():
-    for cls in classes:
-        bpy.utils.register_class(cls)
+    _register_classes()
     register_properties()
+    register_handlers()
+    # Blender doesn't unregister add-ons on quit; close pooled sockets, the cache database and
+    # the screenshot file on interpreter exit instead
+    atexit.register(ai_client.close_at_exit)
 
 def unregister():
-    for cls in classes:
-        bpy.utils.unregister_class(cls)
+    atexit.unregister(ai_client.close_at_exit)
+    _unregister_classes()
     unregister_properties()
+    unregister_handlers()
+    shutdown_event_loop()
+    ai_client.close()
 
@@ -1,4 +1,141 @@
 import bpy
+import re
+from .preferences import get_addon_preferences, get_pref, MODEL_ATTR
+from .ai_client import scene_generation
+
+OUTPUT_PANEL_LINES = 20
+# Output log line kinds in priority order, as lookaheads so the first listed kind wins
+# wherever it appears in the line; OUTPUT_LINE_ICONS is indexed by the matched group
+OUTPUT_LINE_PATTERN = re.compile(
+    r"^(?:(?=.*(error|exception))|(?=.*(warning))|(?=.*(success|completed)))",
+    re.IGNORECASE
+)
+OUTPUT_LINE_ICONS = ('NONE', 'ERROR', 'INFO', 'CHECKMARK')
+# Diff summary lines are prefixed with one of these symbols by AIClient.get_diff_summary()
+DIFF_LINE_ICONS = {
+    '➕': 'ADD',
+    '➖': 'REMOVE',
+    '🎨': 'MATERIAL',
+    '📁': 'OUTLINER_COLLECTION',
+    '🎯': 'RESTRICT_SELECT_OFF',
+    '🔍': 'OBJECT_DATA',
+}
+
+# Help panel content, with the bullet labels formatted once at import
+HELP_EXAMPLES = tuple((f"• {short_desc}", full_prompt) for short_desc, full_prompt in (
+    ("Create a red cube at origin", "Create a red cube at (0,0,0) with a metallic material"),
+    ("Animate rotation", "Add keyframes to rotate the active object 360 degrees over 60 frames"),
+    ("Add subdivision", "Add a subdivision surface modifier to the selected mesh"),
+    ("Duplicate in circle", "Duplicate the selected objects in a circle pattern with 8 copies"),
+    ("Procedural material", "Create a procedural wood material with noise texture"),
+    ("Simple rig", "Create a basic armature rig for the selected mesh")
+))
+HELP_TIPS = tuple(f"• {tip}" for tip in (
+    "Be specific with coordinates and values",
+    "Reference objects by name: 'Cube.001'",
+    "Use 'selected objects' or 'active object'",
+    "Specify frame ranges for animations",
+    "Include material properties and colors",
+    "Mention modifiers and their settings"
+))
+MODEL_RECOMMENDATIONS = (
+    "🥇 Best for Coding:",
+    "   • Claude 3.5 Sonnet (Anthropic)",
+    "   • GPT-4o (OpenAI)",
+    "🥈 Fastest & Affordable:",
+    "   • Gemini 2.5 Flash (Google)",
+    "   • GPT-4o Mini (OpenAI)",
+    "🥉 Most Capable:",
+    "   • Gemini 2.5 Pro (Google)",
+    "   • Claude 3 Opus (Legacy)",
+)
+
+# "AI is thinking" indicator frames; only the sidebar is redrawn to advance them
+SPINNER_INTERVAL = 0.25
+SPINNER_LABELS = tuple(f"{dots} Processing your request {dots}" for dots in (
+    "● ○ ○", "○ ● ○", "○ ○ ●", "○ ● ○"
+))
+_spinner_frame = 0
+
+def _spinner_tick():
+    """Advance the indicator and redraw BlendAI sidebars; stops once no generation is running"""
+    global _spinner_frame
+    context = bpy.context
+    if context.scene is None or not context.scene.ai_is_generating:
+        _spinner_frame = 0
+        return None
+    _spinner_frame = (_spinner_frame + 1) % len(SPINNER_LABELS)
+    for window in context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                for region in area.regions:
+                    if region.type == 'UI':
+                        region.tag_redraw()
+    return SPINNER_INTERVAL
+
+# Panels redraw on most UI events while their text rarely changes, so the rows derived from
+# each text are kept until it does. String properties return a new str on every read, hence
+# the equality check rather than identity.
+_draw_cache = {}
+
+def _cached_rows(key, text, build):
+    """build(text), reused for as long as text is unchanged"""
+    entry = _draw_cache.get(key)
+    if entry is not None and entry[0] == text:
+        return entry[1]
+    rows = build(text)
+    _draw_cache[key] = (text, rows)
+    return rows
+
+def _output_rows(text):
+    """(label, icon) rows for the last OUTPUT_PANEL_LINES log lines, and the footer label if any were cut.
+
+    Labels are truncated here, once per log change, rather than on every redraw.
+    """
+    # Only the tail is shown, so only the tail is split; the rest of the log is just counted
+    tail = text.rsplit('\n', OUTPUT_PANEL_LINES)[-OUTPUT_PANEL_LINES:]
+    rows = []
+    for line in tail:
+        if line.strip():
+            # Add icons based on content
+            match = OUTPUT_LINE_PATTERN.match(line)
+            rows.append((line[:80], OUTPUT_LINE_ICONS[match.lastindex if match else 0]))
+    total_lines = text.count('\n') + 1
+    footer = None
+    if total_lines > OUTPUT_PANEL_LINES:
+        footer = f"... showing last {OUTPUT_PANEL_LINES} of {total_lines} lines"
+    return rows, footer
+
+def _context_sections(context):
+    """(title, icon, lines) boxes describing the selection and active object"""
+    sections = []
+    selected = context.selected_objects
+    num_selected = len(selected)
+    if num_selected:
+        lines = [f"• {obj.type}: {obj.name}" for obj in selected[:5]]  # Show max 5
+        if num_selected > 5:
+            lines.append(f"... and {num_selected - 5} more")
+        sections.append((f"🎯 Selected ({num_selected}):", 'RESTRICT_SELECT_OFF', lines))
+    
+    obj = context.active_object
+    if obj:
+        obj_type = obj.type
+        lines = [f"• {obj_type}: {obj.name}"]
+        mesh = obj.data if obj_type == 'MESH' else None
+        if mesh:
+            lines.append(f"• Vertices: {len(mesh.vertices)}")
+            lines.append(f"• Faces: {len(mesh.polygons)}")
+        sections.append(("🔍 Active Object:", 'OBJECT_DATA', lines))
+    
+    sections.append(("🌍 Scene Overview:", 'SCENE_DATA', [
+        f"• Total Objects: {len(bpy.data.objects)}",
+        f"• Materials: {len(bpy.data.materials)}",
+    ]))
+    return sections
+
+def _diff_rows(text):
+    """(label, icon) rows for the non-blank lines of a diff summary"""
+    return [(line, DIFF_LINE_ICONS.get(line[:1], 'NONE')) for line in text.split('\n') if line.strip()]
 
 class AI_PT_MainPanel(bpy.types.Panel):
     """Main BlendAI panel in the 3D Viewport sidebar"""
@@ -11,7 +148,6 @@ class AI_PT_MainPanel(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         scene = context.scene
-        addon_prefs = context.preferences.addons[__package__].preferences
 
         # Header with current AI provider info
         box = layout.box()
@@ -19,15 +155,9 @@ class AI_PT_MainPanel(bpy.types.Panel):
         row.label(text="🤖 BlendAI Assistant", icon='RNA')
         
         # Provider status
-        provider_info = f"{addon_prefs.ai_provider.upper()}"
-        if addon_prefs.ai_provider == 'openai':
-            provider_info += f" ({addon_prefs.openai_model})"
-        elif addon_prefs.ai_provider == 'anthropic':
-            provider_info += f" ({addon_prefs.anthropic_model})"
-        elif addon_prefs.ai_provider == 'gemini':
-            provider_info += f" ({addon_prefs.gemini_model})"
-        elif addon_prefs.ai_provider == 'local':
-            provider_info += f" ({addon_prefs.local_model})"
+        provider = get_pref('ai_provider')
+        model_attr = MODEL_ATTR.get(provider)
+        provider_info = f"{provider.upper()} ({get_pref(model_attr)})" if model_attr else provider.upper()
         
         box.label(text=f"Provider: {provider_info}", icon='NETWORK_DRIVE')
 
@@ -40,16 +170,18 @@ class AI_PT_MainPanel(bpy.types.Panel):
         col = box.column()
         row = col.row(align=True)
         row.scale_y = 1.5
-        generate_op = row.operator("ai.generate_code", text="🎨 Generate", icon='PLAY')
+        row.operator("ai.generate_code", text="🎨 Generate", icon='PLAY')
         
-        # Show additional options if code exists
-        if scene.ai_generated_code:
+        # Show additional options if code exists. These stay inline rather than in a child
+        # panel: a child's poll() would read the same property on every redraw anyway, and
+        # child panels are drawn below the parent's status boxes, outside this input box
+        if scene.ai_has_code:
             row = col.row(align=True)
             row.operator("ai.execute_code", text="▶️ Execute", icon='FILE_SCRIPT')
             row.operator("ai.refine_code", text="🔧 Refine", icon='MODIFIER')
             
             # Refine feedback input
-            if getattr(scene, 'ai_show_refine_input', False):
+            if scene.ai_show_refine_input:
                 refine_box = col.box()
                 refine_box.label(text="🔧 Refine Instructions:", icon='MODIFIER')
                 refine_box.prop(scene, "ai_refine_feedback", text="", placeholder="Describe what to change or improve...")
@@ -66,24 +198,29 @@ class AI_PT_MainPanel(bpy.types.Panel):
             row.operator("ai.clear_all", text="🧹 Clear All", icon='TRASH')
         
         # AI Status/Progress indicator
-        if hasattr(scene, 'ai_is_generating') and scene.ai_is_generating:
+        if scene.ai_is_generating:
             status_box = layout.box()
             status_box.label(text="🤖 AI is thinking...", icon='TIME')
-            # Add a simple progress indicator
+            # Add a simple progress indicator, animated by a 4 Hz timer rather than by redraws
+            if not bpy.app.timers.is_registered(_spinner_tick):
+                bpy.app.timers.register(_spinner_tick, first_interval=SPINNER_INTERVAL)
             row = status_box.row()
             row.scale_y = 0.5
-            row.label(text="● ● ● Processing your request ● ● ●")
+            row.label(text=SPINNER_LABELS[_spinner_frame])
+            status_box.operator("ai.cancel_generation", text="✗ Cancel", icon='CANCEL')
 
         # Quick Settings
-        if addon_prefs.enable_viewport_screenshot or addon_prefs.enable_diff_summary:
+        screenshots = get_pref('enable_viewport_screenshot')
+        diff_summary = get_pref('enable_diff_summary')
+        if screenshots or diff_summary:
             col = layout.column()
             box = col.box()
             box.label(text="⚙️ Active Features:", icon='SETTINGS')
             
-            if addon_prefs.enable_viewport_screenshot:
+            if screenshots:
                 box.label(text="📸 Viewport Screenshots: ON", icon='CAMERA_DATA')
             
-            if addon_prefs.enable_diff_summary:
+            if diff_summary:
                 box.label(text="📊 Change Tracking: ON", icon='TRACKING')
 
 class AI_PT_CodePanel(bpy.types.Panel):
@@ -95,14 +232,15 @@ class AI_PT_CodePanel(bpy.types.Panel):
     bl_category = 'BlendAI'
     bl_parent_id = "AI_PT_main_panel"
 
+    @classmethod
+    def poll(cls, context):
+        # Hidden until there is code; Blender then skips draw() entirely
+        return context.scene.ai_has_code
+
     def draw(self, context):
         layout = self.layout
         scene = context.scene
         
-        if not scene.ai_generated_code:
-            layout.label(text="No code generated yet", icon='INFO')
-            return
-        
         # Code display and editing
         box = layout.box()
         box.label(text="🐍 Python Code (Editable):", icon='CONSOLE')
@@ -111,9 +249,8 @@ class AI_PT_CodePanel(bpy.types.Panel):
         col = box.column()
         col.prop(scene, "ai_generated_code", text="")
         
-        # Statistics
-        code_lines = scene.ai_generated_code.split('\n')
-        box.label(text=f"📏 {len(code_lines)} lines, {len(scene.ai_generated_code)} characters")
+        # Statistics, computed when the code changes
+        box.label(text=scene.ai_code_stats)
         
         # Quick actions for code
         row = box.row(align=True)
@@ -134,45 +271,32 @@ class AI_PT_OutputPanel(bpy.types.Panel):
     def poll(cls, context):
         # Show if there's any output to display
         scene = context.scene
-        return hasattr(scene, 'ai_last_output') and scene.ai_last_output
+        return scene.ai_has_output
 
     def draw(self, context):
         layout = self.layout
         scene = context.scene
-        
-        if not hasattr(scene, 'ai_last_output') or not scene.ai_last_output:
-            layout.label(text="No output logs yet", icon='INFO')
-            return
+        output = scene.ai_last_output
         
         # Output display in scrollable box
         box = layout.box()
         box.label(text="📋 Execution Output:", icon='CONSOLE')
         
-        # Create scrollable area for logs
-        output_lines = scene.ai_last_output.split('\n')
+        rows, footer = _cached_rows('output', output, _output_rows)
         
-        # Show recent lines (last 20) in a scrollable format
+        # Show recent lines in a scrollable format
         scroll_box = box.box()
         scroll_box.scale_y = 0.8  # Make text smaller for more content
         
-        # Display output lines with different icons for different types
-        for line in output_lines[-20:]:  # Show last 20 lines
-            if line.strip():
-                row = scroll_box.row()
-                row.scale_y = 0.7
-                
-                # Add icons based on content
-                if "ERROR" in line.upper() or "EXCEPTION" in line.upper():
-                    row.label(text=line[:80], icon='ERROR')
-                elif "WARNING" in line.upper():
-                    row.label(text=line[:80], icon='INFO')
-                elif "SUCCESS" in line.upper() or "COMPLETED" in line.upper():
-                    row.label(text=line[:80], icon='CHECKMARK')
-                else:
-                    row.label(text=line[:80])
+        # Display output lines with different icons for different types; one scaled column
+        # holds them all instead of a scaled row per line
+        col = scroll_box.column()
+        col.scale_y = 0.7
+        for text, icon in rows:
+            col.label(text=text, icon=icon)
         
-        if len(output_lines) > 20:
-            box.label(text=f"... showing last 20 of {len(output_lines)} lines")
+        if footer:
+            box.label(text=footer)
         
         # Clear output button
         row = box.row()
@@ -190,38 +314,19 @@ class AI_PT_DiffPanel(bpy.types.Panel):
     @classmethod
     def poll(cls, context):
         # Only show if diff summary is enabled and exists
-        addon_prefs = context.preferences.addons[__package__].preferences
-        return addon_prefs.enable_diff_summary and context.scene.ai_diff_summary
+        return get_pref('enable_diff_summary') and context.scene.ai_has_diff
 
     def draw(self, context):
         layout = self.layout
         scene = context.scene
-        
-        if not scene.ai_diff_summary:
-            return
+        summary = scene.ai_diff_summary
         
         box = layout.box()
         box.label(text="📊 Scene Changes:", icon='TRACKING')
         
         # Parse and display diff summary
-        diff_lines = scene.ai_diff_summary.split('\n')
-        
-        for line in diff_lines:
-            if line.strip():
-                if line.startswith('➕'):
-                    box.label(text=line, icon='ADD')
-                elif line.startswith('➖'):
-                    box.label(text=line, icon='REMOVE')
-                elif line.startswith('🎨'):
-                    box.label(text=line, icon='MATERIAL')
-                elif line.startswith('📁'):
-                    box.label(text=line, icon='OUTLINER_COLLECTION')
-                elif line.startswith('🎯'):
-                    box.label(text=line, icon='RESTRICT_SELECT_OFF')
-                elif line.startswith('🔍'):
-                    box.label(text=line, icon='OBJECT_DATA')
-                else:
-                    box.label(text=line)
+        for text, icon in _cached_rows('diff', summary, _diff_rows):
+            box.label(text=text, icon=icon)
 
 class AI_PT_HelpPanel(bpy.types.Panel):
     """Help and tips panel with prompt examples"""
@@ -236,71 +341,42 @@ class AI_PT_HelpPanel(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         scene = context.scene
-        addon_prefs = context.preferences.addons[__package__].preferences
+        addon_prefs = get_addon_preferences()
         
         # Viewport Screenshot Toggle
-        if hasattr(addon_prefs, 'enable_viewport_screenshot'):
-            box = layout.box()
-            box.label(text="📸 Viewport Context:", icon='CAMERA_DATA')
-            row = box.row()
-            row.prop(addon_prefs, "enable_viewport_screenshot", text="Include Screenshot")
-            if addon_prefs.enable_viewport_screenshot:
-                box.label(text="✓ AI will see current viewport", icon='CHECKMARK')
+        box = layout.box()
+        box.label(text="📸 Viewport Context:", icon='CAMERA_DATA')
+        row = box.row()
+        row.prop(addon_prefs, "enable_viewport_screenshot", text="Include Screenshot")
+        if get_pref('enable_viewport_screenshot'):
+            box.label(text="✓ AI will see current viewport", icon='CHECKMARK')
         
         # Quick Example Prompts (clickable)
         box = layout.box()
         box.label(text="🎯 Quick Start Examples:", icon='COPYDOWN')
         
-        examples = [
-            ("Create a red cube at origin", "Create a red cube at (0,0,0) with a metallic material"),
-            ("Animate rotation", "Add keyframes to rotate the active object 360 degrees over 60 frames"),
-            ("Add subdivision", "Add a subdivision surface modifier to the selected mesh"),
-            ("Duplicate in circle", "Duplicate the selected objects in a circle pattern with 8 copies"),
-            ("Procedural material", "Create a procedural wood material with noise texture"),
-            ("Simple rig", "Create a basic armature rig for the selected mesh")
-        ]
-        
-        for short_desc, full_prompt in examples:
-            row = box.row()
-            op = row.operator("ai.set_prompt_example", text=f"• {short_desc}")
-            op.prompt_text = full_prompt
+        for label, full_prompt in HELP_EXAMPLES:
+            box.operator("ai.set_prompt_example", text=label).prompt_text = full_prompt
         
         # Advanced Tips
         box = layout.box()
         box.label(text="💡 Pro Tips:", icon='LIGHTBULB')
         
-        tips = [
-            "Be specific with coordinates and values",
-            "Reference objects by name: 'Cube.001'",
-            "Use 'selected objects' or 'active object'",
-            "Specify frame ranges for animations",
-            "Include material properties and colors",
-            "Mention modifiers and their settings"
-        ]
-        
-        for tip in tips:
-            row = box.row()
-            row.scale_y = 0.8
-            row.label(text=f"• {tip}")
+        col = box.column()
+        col.scale_y = 0.8
+        for label in HELP_TIPS:
+            col.label(text=label)
         
         # Model Comparison (collapsed by default)
+        show_model_info = scene.ai_show_model_info
         box = layout.box()
         row = box.row()
-        row.prop(scene, "ai_show_model_info", icon='TRIA_DOWN' if getattr(scene, 'ai_show_model_info', False) else 'TRIA_RIGHT', emboss=False)
+        row.prop(scene, "ai_show_model_info", icon='TRIA_DOWN' if show_model_info else 'TRIA_RIGHT', emboss=False)
         row.label(text="🏆 Model Recommendations")
         
-        if getattr(scene, 'ai_show_model_info', False):
-            box.label(text="🥇 Best for Coding:")
-            box.label(text="   • Claude 3.5 Sonnet (Anthropic)")
-            box.label(text="   • GPT-4o (OpenAI)")
-            
-            box.label(text="🥈 Fastest & Affordable:")
-            box.label(text="   • Gemini 2.5 Flash (Google)")
-            box.label(text="   • GPT-4o Mini (OpenAI)")
-            
-            box.label(text="🥉 Most Capable:")
-            box.label(text="   • Gemini 2.5 Pro (Google)")
-            box.label(text="   • Claude 3 Opus (Legacy)")
+        if show_model_info:
+            for label in MODEL_RECOMMENDATIONS:
+                box.label(text=label)
 
 # Scene context display panel
 class AI_PT_ContextPanel(bpy.types.Panel):
@@ -316,33 +392,18 @@ class AI_PT_ContextPanel(bpy.types.Panel):
     def draw(self, context):
         layout = self.layout
         
-        # Selected objects
-        if context.selected_objects:
-            box = layout.box()
-            box.label(text=f"🎯 Selected ({len(context.selected_objects)}):", icon='RESTRICT_SELECT_OFF')
-            
-            for obj in context.selected_objects[:5]:  # Show max 5
-                row = box.row()
-                row.label(text=f"• {obj.type}: {obj.name}")
-            
-            if len(context.selected_objects) > 5:
-                box.label(text=f"... and {len(context.selected_objects) - 5} more")
+        # Selection, object and data changes all go through the depsgraph, so the formatted
+        # lines are rebuilt only after an update rather than on every redraw
+        key = (scene_generation(), context.scene.name, context.view_layer.name)
+        sections = _cached_rows('context', key, lambda _key: _context_sections(context))
         
-        # Active object
-        if context.active_object:
+        for title, icon, lines in sections:
             box = layout.box()
-            box.label(text="🔍 Active Object:", icon='OBJECT_DATA')
-            obj = context.active_object
-            box.label(text=f"• {obj.type}: {obj.name}")
-            if obj.type == 'MESH' and obj.data:
-                box.label(text=f"• Vertices: {len(obj.data.vertices)}")
-                box.label(text=f"• Faces: {len(obj.data.polygons)}")
+            box.label(text=title, icon=icon)
+            for line in lines:
+                box.label(text=line)
         
-        # Scene overview
-        box = layout.box()
-        box.label(text="🌍 Scene Overview:", icon='SCENE_DATA')
-        box.label(text=f"• Total Objects: {len(bpy.data.objects)}")
-        box.label(text=f"• Materials: {len(bpy.data.materials)}")
+        # Mode and frame switches aren't guaranteed to report a depsgraph update; read them live
         box.label(text=f"• Current Mode: {context.mode}")
         box.label(text=f"• Frame: {context.scene.frame_current}")
 
@@ -356,10 +417,19 @@ classes = [
     AI_PT_ContextPanel,
 ]
 
+_register_classes, _unregister_classes = bpy.utils.register_classes_factory(classes)
+
 def register():
-    for cls in classes:
-        bpy.utils.register_class(cls)
+    # A script reload without unregister leaves the previous module's panels in place; drop
+    # them (children first) so each panel is registered, and drawn, only once
+    for cls in reversed(classes):
+        stale = bpy.types.Panel.bl_rna_get_subclass_py(cls.bl_idname)
+        if stale is not None:
+            bpy.utils.unregister_class(stale)
+    _register_classes()
 
 def unregister():
-    for cls in classes:
-        bpy.utils.unregister_class(cls)
+    if bpy.app.timers.is_registered(_spinner_tick):
+        bpy.app.timers.unregister(_spinner_tick)
+    _unregister_classes()
+    _draw_cache.clear()
@@ -1,4 +1,265 @@
 import bpy
+import json
+import os
+from bpy.app.handlers import persistent
+
+def get_addon_preferences():
+    """Return this addon's preferences.
+
+    Looked up on every call: Revert to Saved Preferences replaces the add-on's preferences
+    without re-registering it, so a kept reference could point at freed data.
+    """
+    return bpy.context.preferences.addons[__package__].preferences
+
+# Plain values of preferences read on every redraw or log line, filled on first read.
+# Dropped by every property's update callback, on factory reset, file load and unregister; no RNA
+# pointer is kept, so a replaced preferences struct can leave values stale but never dangling
+_pref_values = {}
+
+def get_pref(name):
+    """Value of a preference property; a dict lookup until a preference changes"""
+    try:
+        return _pref_values[name]
+    except KeyError:
+        value = _pref_values[name] = getattr(get_addon_preferences(), name)
+        return value
+
+def _pref_changed(self, context):
+    _pref_values.clear()
+
+# Real keys are well under this; it bounds what a bad paste can store
+API_KEY_MAXLEN = 256
+
+# Text preferences stored trimmed, so readers never need to strip them
+TRIMMED_ATTRS = ('openai_api_key', 'anthropic_api_key', 'gemini_api_key', 'local_api_url')
+
+# Set while _trim_text rewrites a value, whose own update callback then re-enters
+_trimming = False
+# Set while _restore_api_keys fills in keys that were just read from the keys file
+_restoring_api_keys = False
+
+def _trim_text(prefs):
+    """Drop whitespace picked up when pasting; returns False for the nested update a rewrite triggers"""
+    global _trimming
+    if _trimming:
+        return False
+    _trimming = True
+    try:
+        for attr in TRIMMED_ATTRS:
+            value = getattr(prefs, attr)
+            stripped = value.strip()
+            if stripped != value:
+                setattr(prefs, attr, stripped)
+    finally:
+        _trimming = False
+    _pref_values.clear()
+    return True
+
+def _trimmed_text_changed(self, context):
+    _trim_text(self)
+
+def _api_key_changed(self, context):
+    # Only key edits rewrite the keys file, once per edit and not while restoring from it
+    if _trim_text(self) and not _restoring_api_keys:
+        _save_api_keys(self)
+
+# Copy of the API keys kept beside Blender's own config, so they survive a session whose
+# preferences were never saved
+API_KEYS_FILE = "blendai_keys.json"
+
+def _api_keys_path():
+    return os.path.join(bpy.utils.user_resource('CONFIG'), API_KEYS_FILE)
+
+def _save_api_keys(prefs):
+    """Write the non-empty API keys to the keys file (owner-only), or remove it when there are none"""
+    keys = {provider: getattr(prefs, attr) for provider, attr in API_KEY_ATTR.items() if getattr(prefs, attr)}
+    path = _api_keys_path()
+    try:
+        if not keys:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A fresh owner-only file replaces the old one, so an existing file with looser
+        # permissions never receives the keys
+        temp_path = path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(keys, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not save API keys: {e}")
+
+def _restore_api_keys():
+    """Fill in the API keys from the keys file when the preferences have none; runs once as a timer"""
+    try:
+        prefs = get_addon_preferences()
+    except KeyError:
+        return None
+    if any(getattr(prefs, attr) for attr in API_KEY_ATTR.values()):
+        return None
+    path = _api_keys_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            keys = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read saved API keys: {e}")
+        return None
+    global _restoring_api_keys
+    _restoring_api_keys = True
+    try:
+        for provider, attr in API_KEY_ATTR.items():
+            key = keys.get(provider)
+            if isinstance(key, str) and key:
+                setattr(prefs, attr, key)
+    finally:
+        _restoring_api_keys = False
+    return None
+
+# Preference property holding each provider's model and API key (local servers take no key)
+MODEL_ATTR = {
+    'openai': 'openai_model',
+    'anthropic': 'anthropic_model',
+    'gemini': 'gemini_model',
+    'local': 'local_model',
+}
+API_KEY_ATTR = {
+    'openai': 'openai_api_key',
+    'anthropic': 'anthropic_api_key',
+    'gemini': 'gemini_api_key',
+}
+
+# Enum items shared by the property definitions and the lookup tables below. They are passed
+# as static sequences on purpose: RNA copies them once at registration, whereas an items
+# callback would be called back into Python on every draw and lookup of the enum
+PROVIDER_ITEMS = (
+    ('openai', 'OpenAI', 'Use OpenAI GPT models'),
+    ('anthropic', 'Anthropic', 'Use Anthropic Claude models'),
+    ('gemini', 'Google Gemini', 'Use Google Gemini models'),
+    ('local', 'Local LLM', 'Use local language model server'),
+)
+OPENAI_MODEL_ITEMS = (
+    ('gpt-4.1', 'GPT-4.1', 'Latest GPT model with 1M context (April 2025)'),
+    ('gpt-4.1-mini', 'GPT-4.1 Mini', 'Faster and cheaper version of GPT-4.1'),
+    ('gpt-4.1-nano', 'GPT-4.1 Nano', 'Ultra-fast and cost-effective model'),
+    ('o3', 'o3', 'Advanced reasoning model (latest)'),
+    ('o3-mini', 'o3-mini', 'Smaller reasoning model'),
+    ('o4-mini', 'o4-mini', 'Small but powerful model'),
+    ('gpt-4o', 'GPT-4o', 'Multimodal model with vision capabilities'),
+    ('gpt-4o-mini', 'GPT-4o Mini', 'Efficient multimodal model'),
+    ('o1', 'o1', 'Reasoning model (previous generation)'),
+    ('o1-mini', 'o1-mini', 'Smaller reasoning model (previous generation)'),
+)
+ANTHROPIC_MODEL_ITEMS = (
+    ('claude-4-opus', 'Claude 4 Opus', 'Most powerful coding model (May 2025)'),
+    ('claude-4-sonnet', 'Claude 4 Sonnet', 'High-performance model with reasoning'),
+    ('claude-3.7-sonnet', 'Claude 3.7 Sonnet', 'Hybrid reasoning model (Feb 2025)'),
+    ('claude-3.5-sonnet', 'Claude 3.5 Sonnet', 'Balanced performance model'),
+    ('claude-3.5-haiku', 'Claude 3.5 Haiku', 'Fast and efficient model'),
+    ('claude-3-opus', 'Claude 3 Opus', 'Legacy powerful model'),
+    ('claude-3-sonnet', 'Claude 3 Sonnet', 'Legacy balanced model'),
+    ('claude-3-haiku', 'Claude 3 Haiku', 'Legacy fast model'),
+)
+GEMINI_MODEL_ITEMS = (
+    ('gemini-2.5-pro', 'Gemini 2.5 Pro', 'Most advanced with thinking capabilities (June 2025)'),
+    ('gemini-2.5-flash', 'Gemini 2.5 Flash', 'Best price-performance with thinking'),
+    ('gemini-2.5-flash-lite', 'Gemini 2.5 Flash-Lite', 'Cost-efficient model'),
+    ('gemini-2.0-flash', 'Gemini 2.0 Flash', 'Next-gen features and speed'),
+    ('gemini-2.0-flash-lite', 'Gemini 2.0 Flash-Lite', 'Cost-efficient 2.0 model'),
+    ('gemini-1.5-pro', 'Gemini 1.5 Pro', 'Legacy advanced model'),
+    ('gemini-1.5-flash', 'Gemini 1.5 Flash', 'Legacy fast model'),
+    ('gemini-1.5-flash-8b', 'Gemini 1.5 Flash-8B', 'Legacy lightweight model'),
+)
+SCREENSHOT_RESOLUTION_ITEMS = (
+    ('512', '512x512', 'Low resolution, faster processing'),
+    ('1024', '1024x1024', 'Medium resolution, balanced'),
+    ('2048', '2048x2048', 'High resolution, slower processing'),
+)
+THINKING_BUDGET_ITEMS = (
+    ('auto', 'Auto', 'Let the model decide based on task complexity'),
+    ('low', 'Low', 'Quick responses with minimal thinking'),
+    ('medium', 'Medium', 'Balanced thinking and speed'),
+    ('high', 'High', 'Deep reasoning for complex tasks'),
+    ('max', 'Maximum', 'Extensive reasoning for the most complex tasks'),
+)
+
+# Pixel size for each max_screenshot_resolution choice, so readers skip the int() parse
+SCREENSHOT_RESOLUTION_PX = {item[0]: int(item[0]) for item in SCREENSHOT_RESOLUTION_ITEMS}
+
+# Static text for the preferences UI, built once at import instead of on every redraw
+MODEL_INFO = {
+    'openai': {
+        'gpt-4.1': '🚀 Latest model with 1M context window',
+        'gpt-4.1-mini': '⚡ Fast and efficient',
+        'o3': '🧠 Advanced reasoning capabilities',
+        'o4-mini': '💡 Small but powerful',
+        'gpt-4o': '👁️ Multimodal with vision'
+    },
+    'anthropic': {
+        'claude-4-opus': '🥇 Best coding model worldwide',
+        'claude-4-sonnet': '⚡ High-performance with reasoning',
+        'claude-3.7-sonnet': '🔄 Hybrid reasoning model',
+        'claude-3.5-sonnet': '⚖️ Balanced performance'
+    },
+    'gemini': {
+        'gemini-2.5-pro': '🧠 Most advanced with thinking',
+        'gemini-2.5-flash': '💰 Best price-performance',
+        'gemini-2.0-flash': '🚀 Next-gen features',
+        'gemini-1.5-pro': '📚 Large context window'
+    },
+    'local': {},  # local_model is free text
+}
+# Models that accept a thinking budget, matching the prefixes ai_client checks
+REASONING_MODELS = {
+    'anthropic': frozenset({'claude-4-opus', 'claude-4-sonnet', 'claude-3.7-sonnet'}),
+    'gemini': frozenset({
+        'gemini-2.5-pro', 'gemini-2.5-flash', 'gemini-2.5-flash-lite',
+        'gemini-2.0-flash', 'gemini-2.0-flash-lite'
+    }),
+}
+PROVIDER_KEY_HINTS = {
+    'openai': "→ Visit platform.openai.com to get your API key",
+    'anthropic': "→ Visit console.anthropic.com to get your API key",
+    'gemini': "→ Visit aistudio.google.com to get your API key",
+}
+PROVIDER_TIPS = {
+    'openai': (
+        "• Get your API key from platform.openai.com",
+        "• GPT-4.1 offers the best capabilities for 3D modeling",
+        "• Create an account and navigate to API Keys section",
+    ),
+    'anthropic': (
+        "• Get your API key from console.anthropic.com",
+        "• Claude 4 Opus excels at complex coding tasks",
+        "• Sign up and go to API Keys in your dashboard",
+    ),
+    'gemini': (
+        "• Get your API key from aistudio.google.com",
+        "• Gemini 2.5 models support advanced reasoning",
+        "• Create a project and generate an API key",
+    ),
+    'local': (
+        "• Ensure your local LLM server is running",
+        "• Test the URL in your browser first",
+        "• Common ports: 8080, 11434 (Ollama), 5000",
+    ),
+}
+SECURITY_NOTES = (
+    "• API keys are stored locally in Blender preferences and its config folder",
+    "• Keys are not transmitted except to your chosen AI provider",
+    "• For maximum security, use environment variables",
+)
+# Full security box contents for each kind of provider
+SECURITY_NOTES_CLOUD = SECURITY_NOTES + ("• Your code prompts are sent to the AI provider for processing",)
+SECURITY_NOTES_LOCAL = SECURITY_NOTES + ("• Local models keep all data on your machine",)
+
+@persistent
+def _clear_preferences_cache(*args):
+    _pref_values.clear()
 
 class AICodePreferences(bpy.types.AddonPreferences):
     bl_idname = __package__
@@ -6,27 +267,34 @@ class AICodePreferences(bpy.types.AddonPreferences):
     # API Keys for different providers
     openai_api_key: bpy.props.StringProperty(
         name="OpenAI API Key",
+        update=_api_key_changed,
         description="Your OpenAI API key for GPT models",
         default="",
+        maxlen=API_KEY_MAXLEN,
         subtype='PASSWORD'
     )
     
     anthropic_api_key: bpy.props.StringProperty(
         name="Anthropic API Key", 
+        update=_api_key_changed,
         description="Your Anthropic API key for Claude models",
         default="",
+        maxlen=API_KEY_MAXLEN,
         subtype='PASSWORD'
     )
     
     gemini_api_key: bpy.props.StringProperty(
         name="Gemini API Key",
+        update=_api_key_changed,
         description="Your Google API key for Gemini models",
         default="",
+        maxlen=API_KEY_MAXLEN,
         subtype='PASSWORD'
     )
     
     local_api_url: bpy.props.StringProperty(
         name="Local API URL",
+        update=_trimmed_text_changed,
         description="URL for your local LLM server (e.g., http://localhost:1234/v1)",
         default="http://localhost:1234/v1"
     )
@@ -34,72 +302,43 @@ class AICodePreferences(bpy.types.AddonPreferences):
     # AI Provider Selection
     ai_provider: bpy.props.EnumProperty(
         name="AI Provider",
+        update=_pref_changed,
         description="Choose your preferred AI model provider",
-        items=[
-            ('openai', 'OpenAI', 'Use OpenAI GPT models'),
-            ('anthropic', 'Anthropic', 'Use Anthropic Claude models'),
-            ('gemini', 'Google Gemini', 'Use Google Gemini models'),
-            ('local', 'Local LLM', 'Use local language model server')
-        ],
+        items=PROVIDER_ITEMS,
         default='openai'
     )
     
     # OpenAI Model Selection (Updated 2025)
     openai_model: bpy.props.EnumProperty(
         name="OpenAI Model",
+        update=_pref_changed,
         description="Select OpenAI model to use",
-        items=[
-            ('gpt-4.1', 'GPT-4.1', 'Latest GPT model with 1M context (April 2025)'),
-            ('gpt-4.1-mini', 'GPT-4.1 Mini', 'Faster and cheaper version of GPT-4.1'),
-            ('gpt-4.1-nano', 'GPT-4.1 Nano', 'Ultra-fast and cost-effective model'),
-            ('o3', 'o3', 'Advanced reasoning model (latest)'),
-            ('o3-mini', 'o3-mini', 'Smaller reasoning model'),
-            ('o4-mini', 'o4-mini', 'Small but powerful model'),
-            ('gpt-4o', 'GPT-4o', 'Multimodal model with vision capabilities'),
-            ('gpt-4o-mini', 'GPT-4o Mini', 'Efficient multimodal model'),
-            ('o1', 'o1', 'Reasoning model (previous generation)'),
-            ('o1-mini', 'o1-mini', 'Smaller reasoning model (previous generation)')
-        ],
+        items=OPENAI_MODEL_ITEMS,
         default='gpt-4.1'
     )
     
     # Anthropic Model Selection (Updated 2025)
     anthropic_model: bpy.props.EnumProperty(
         name="Anthropic Model",
+        update=_pref_changed,
         description="Select Anthropic Claude model to use",
-        items=[
-            ('claude-4-opus', 'Claude 4 Opus', 'Most powerful coding model (May 2025)'),
-            ('claude-4-sonnet', 'Claude 4 Sonnet', 'High-performance model with reasoning'),
-            ('claude-3.7-sonnet', 'Claude 3.7 Sonnet', 'Hybrid reasoning model (Feb 2025)'),
-            ('claude-3.5-sonnet', 'Claude 3.5 Sonnet', 'Balanced performance model'),
-            ('claude-3.5-haiku', 'Claude 3.5 Haiku', 'Fast and efficient model'),
-            ('claude-3-opus', 'Claude 3 Opus', 'Legacy powerful model'),
-            ('claude-3-sonnet', 'Claude 3 Sonnet', 'Legacy balanced model'),
-            ('claude-3-haiku', 'Claude 3 Haiku', 'Legacy fast model')
-        ],
+        items=ANTHROPIC_MODEL_ITEMS,
         default='claude-4-sonnet'
     )
     
     # Gemini Model Selection (Updated 2025)
     gemini_model: bpy.props.EnumProperty(
         name="Gemini Model",
+        update=_pref_changed,
         description="Select Google Gemini model to use",
-        items=[
-            ('gemini-2.5-pro', 'Gemini 2.5 Pro', 'Most advanced with thinking capabilities (June 2025)'),
-            ('gemini-2.5-flash', 'Gemini 2.5 Flash', 'Best price-performance with thinking'),
-            ('gemini-2.5-flash-lite', 'Gemini 2.5 Flash-Lite', 'Cost-efficient model'),
-            ('gemini-2.0-flash', 'Gemini 2.0 Flash', 'Next-gen features and speed'),
-            ('gemini-2.0-flash-lite', 'Gemini 2.0 Flash-Lite', 'Cost-efficient 2.0 model'),
-            ('gemini-1.5-pro', 'Gemini 1.5 Pro', 'Legacy advanced model'),
-            ('gemini-1.5-flash', 'Gemini 1.5 Flash', 'Legacy fast model'),
-            ('gemini-1.5-flash-8b', 'Gemini 1.5 Flash-8B', 'Legacy lightweight model')
-        ],
+        items=GEMINI_MODEL_ITEMS,
         default='gemini-2.5-flash'
     )
     
     # Local Model Name
     local_model: bpy.props.StringProperty(
         name="Local Model Name",
+        update=_pref_changed,
         description="Name of the local model to use (e.g., 'llama3', 'codellama')",
         default="llama3"
     )
@@ -107,40 +346,116 @@ class AICodePreferences(bpy.types.AddonPreferences):
     # Enhanced Settings
     enable_diff_summary: bpy.props.BoolProperty(
         name="Enable Diff Summary",
+        update=_pref_changed,
         description="Show a summary of changes after code execution",
         default=True
     )
     
     enable_viewport_screenshot: bpy.props.BoolProperty(
         name="Enable Viewport Screenshot",
+        update=_pref_changed,
         description="Include viewport screenshot in AI prompts for better context",
         default=True
     )
     
     max_screenshot_resolution: bpy.props.EnumProperty(
         name="Screenshot Resolution",
+        update=_pref_changed,
         description="Maximum resolution for viewport screenshots",
-        items=[
-            ('512', '512x512', 'Low resolution, faster processing'),
-            ('1024', '1024x1024', 'Medium resolution, balanced'),
-            ('2048', '2048x2048', 'High resolution, slower processing')
-        ],
+        items=SCREENSHOT_RESOLUTION_ITEMS,
         default='1024'
     )
     
+    screenshot_quality: bpy.props.IntProperty(
+        name="Screenshot Quality",
+        update=_pref_changed,
+        description="JPEG quality of viewport screenshots; lower values upload faster and cost fewer image tokens",
+        default=85,
+        min=10,
+        max=100,
+        subtype='PERCENTAGE'
+    )
+    
+    enable_response_cache: bpy.props.BoolProperty(
+        name="Enable Response Cache",
+        update=_pref_changed,
+        description="Reuse stored AI responses for identical requests instead of calling the provider again",
+        default=True
+    )
+    
+    enable_semantic_cache: bpy.props.BoolProperty(
+        name="Enable Semantic Cache",
+        update=_pref_changed,
+        description="Also reuse responses for requests with exactly the same words and numbers as an earlier one in the same scene, differing only in order, case or punctuation",
+        default=False
+    )
+    
+    semantic_cache_threshold: bpy.props.FloatProperty(
+        name="Similarity Threshold",
+        update=_pref_changed,
+        description="Minimum similarity (0-1) for a reordered request to reuse a cached response",
+        default=0.9,
+        min=0.5,
+        max=1.0
+    )
+    
+    enable_streaming: bpy.props.BoolProperty(
+        name="Stream Responses",
+        update=_pref_changed,
+        description="Show generated code as it arrives instead of waiting for the full response",
+        default=True
+    )
+    
+    compress_requests: bpy.props.BoolProperty(
+        name="Compress Large Requests",
+        update=_pref_changed,
+        description="Gzip large request bodies (big scenes, screenshots) before upload. Turn off if a provider rejects them",
+        default=False
+    )
+    
+    keep_full_history: bpy.props.BoolProperty(
+        name="Keep Full History",
+        update=_pref_changed,
+        description="Keep complete requests and responses in the session history instead of only the first 4 KB",
+        default=False
+    )
+    
+    enable_output_log: bpy.props.BoolProperty(
+        name="Enable Output Log",
+        update=_pref_changed,
+        description="Write generation and execution status lines to the output log",
+        default=True
+    )
+    
+    show_setup_help: bpy.props.BoolProperty(
+        name="Setup Tips & Security",
+        update=_pref_changed,
+        description="Show the setup tips and security notes below the status box",
+        default=False
+    )
+    
     thinking_budget: bpy.props.EnumProperty(
         name="Thinking Budget",
+        update=_pref_changed,
         description="Control how much reasoning the AI should do (for models that support it)",
-        items=[
-            ('auto', 'Auto', 'Let the model decide based on task complexity'),
-            ('low', 'Low', 'Quick responses with minimal thinking'),
-            ('medium', 'Medium', 'Balanced thinking and speed'),
-            ('high', 'High', 'Deep reasoning for complex tasks'),
-            ('max', 'Maximum', 'Extensive reasoning for the most complex tasks')
-        ],
+        items=THINKING_BUDGET_ITEMS,
         default='auto'
     )
 
+    def provider_api_key(self, provider=None):
+        """API key for a provider (defaults to the selected one); empty for local servers"""
+        attr = API_KEY_ATTR.get(provider or get_pref('ai_provider'))
+        return get_pref(attr) if attr else ""
+
+    def provider_model(self, provider=None):
+        """Configured model for a provider (defaults to the selected one)"""
+        attr = MODEL_ATTR.get(provider or self.ai_provider)
+        return getattr(self, attr, None) if attr else None
+
+    def screenshot_resolution(self):
+        """Maximum screenshot size in pixels"""
+        return SCREENSHOT_RESOLUTION_PX[self.max_screenshot_resolution]
+
     def draw(self, context):
         layout = self.layout
         
@@ -154,76 +469,24 @@ class AICodePreferences(bpy.types.AddonPreferences):
         provider_box.label(text="AI Provider Settings:", icon='WORLD')
         provider_box.prop(self, "ai_provider")
         
-        # Provider-specific settings
-        if self.ai_provider == 'openai':
-            # API Key field with visual indicator
-            key_row = provider_box.row()
-            if not self.openai_api_key or not self.openai_api_key.strip():
-                key_row.alert = True
-            key_row.prop(self, "openai_api_key")
-            
-            provider_box.prop(self, "openai_model")
-            
-            # Show model info
-            model_info = {
-                'gpt-4.1': '🚀 Latest model with 1M context window',
-                'gpt-4.1-mini': '⚡ Fast and efficient',
-                'o3': '🧠 Advanced reasoning capabilities',
-                'o4-mini': '💡 Small but powerful',
-                'gpt-4o': '👁️ Multimodal with vision'
-            }
-            if self.openai_model in model_info:
-                info_row = provider_box.row()
-                info_row.label(text=model_info[self.openai_model], icon='INFO')
-                
-        elif self.ai_provider == 'anthropic':
-            # API Key field with visual indicator
-            key_row = provider_box.row()
-            if not self.anthropic_api_key or not self.anthropic_api_key.strip():
-                key_row.alert = True
-            key_row.prop(self, "anthropic_api_key")
-            
-            provider_box.prop(self, "anthropic_model")
-            
-            # Show model info
-            model_info = {
-                'claude-4-opus': '🥇 Best coding model worldwide',
-                'claude-4-sonnet': '⚡ High-performance with reasoning',
-                'claude-3.7-sonnet': '🔄 Hybrid reasoning model',
-                'claude-3.5-sonnet': '⚖️ Balanced performance'
-            }
-            if self.anthropic_model in model_info:
-                info_row = provider_box.row()
-                info_row.label(text=model_info[self.anthropic_model], icon='INFO')
-                
-        elif self.ai_provider == 'gemini':
-            # API Key field with visual indicator
-            key_row = provider_box.row()
-            if not self.gemini_api_key or not self.gemini_api_key.strip():
-                key_row.alert = True
-            key_row.prop(self, "gemini_api_key")
-            
-            provider_box.prop(self, "gemini_model")
-            
-            # Show model info  
-            model_info = {
-                'gemini-2.5-pro': '🧠 Most advanced with thinking',
-                'gemini-2.5-flash': '💰 Best price-performance',
-                'gemini-2.0-flash': '🚀 Next-gen features',
-                'gemini-1.5-pro': '📚 Large context window'
-            }
-            if self.gemini_model in model_info:
-                info_row = provider_box.row()
-                info_row.label(text=model_info[self.gemini_model], icon='INFO')
-                
-        elif self.ai_provider == 'local':
-            # API URL field with visual indicator
-            url_row = provider_box.row()
-            if not self.local_api_url or not self.local_api_url.strip():
-                url_row.alert = True
-            url_row.prop(self, "local_api_url")
-            
-            provider_box.prop(self, "local_model")
+        # Provider-specific settings: the field the provider needs (API key, or the server URL
+        # for local models) with a visual indicator, then the model and its description
+        provider = get_pref('ai_provider')
+        field_attr = API_KEY_ATTR.get(provider, 'local_api_url')
+        model_attr = MODEL_ATTR[provider]
+        field_value = get_pref(field_attr)
+        field_missing = not field_value or field_value.isspace()
+        
+        field_row = provider_box.row()
+        field_row.alert = field_missing
+        field_row.prop(self, field_attr)
+        
+        provider_box.prop(self, model_attr)
+        
+        info = MODEL_INFO[provider].get(get_pref(model_attr))
+        if info:
+            info_row = provider_box.row()
+            info_row.label(text=info, icon='INFO')
             
         # Enhanced Features
         features_box = layout.box()
@@ -231,16 +494,28 @@ class AICodePreferences(bpy.types.AddonPreferences):
         features_box.prop(self, "enable_diff_summary")
         features_box.prop(self, "enable_viewport_screenshot")
         
-        if self.enable_viewport_screenshot:
+        if get_pref('enable_viewport_screenshot'):
             features_box.prop(self, "max_screenshot_resolution")
+            features_box.prop(self, "screenshot_quality")
+        features_box.prop(self, "enable_response_cache")
+        if get_pref('enable_response_cache'):
+            features_box.prop(self, "enable_semantic_cache")
+            if get_pref('enable_semantic_cache'):
+                features_box.prop(self, "semantic_cache_threshold")
+        features_box.prop(self, "enable_streaming")
+        if provider != 'local':
+            features_box.prop(self, "compress_requests")
+        features_box.prop(self, "keep_full_history")
+        features_box.prop(self, "enable_output_log")
             
         # AI Reasoning Settings
-        if self.ai_provider in ['gemini', 'anthropic'] and any(x in self.gemini_model or x in self.anthropic_model for x in ['2.5', '4', '3.7']):
+        reasoning_models = REASONING_MODELS.get(provider)
+        if reasoning_models and get_pref(MODEL_ATTR[provider]) in reasoning_models:
             reasoning_box = layout.box()
             reasoning_box.label(text="AI Reasoning:", icon='OUTLINER_OB_LIGHTPROBE')
             reasoning_box.prop(self, "thinking_budget")
             
-            if self.thinking_budget != 'auto':
+            if get_pref('thinking_budget') != 'auto':
                 info_row = reasoning_box.row()
                 info_row.label(text="💡 Higher thinking budgets improve quality but increase cost", icon='INFO')
         
@@ -248,22 +523,14 @@ class AICodePreferences(bpy.types.AddonPreferences):
         status_box = layout.box()
         status_box.label(text="Status:", icon='CHECKMARK')
         
-        # Check API key
-        api_key = ""
-        if self.ai_provider == 'openai':
-            api_key = self.openai_api_key
-        elif self.ai_provider == 'anthropic':
-            api_key = self.anthropic_api_key
-        elif self.ai_provider == 'gemini':
-            api_key = self.gemini_api_key
-        elif self.ai_provider == 'local':
-            api_key = "local"  # Always show as configured for local
-            
-        if api_key and api_key.strip():
+        # Local servers always show as configured; otherwise the key read above decides
+        configured = provider == 'local' or not field_missing
+        if configured:
             status_box.label(text="✅ API configured", icon='CHECKMARK')
             # Add test connection button
             test_row = status_box.row()
             test_row.operator("ai.test_connection", text="Test Connection", icon='PLUGIN')
+            test_row.operator("ai.test_connection", text="Test All Providers", icon='WORLD').all_providers = True
         else:
             # Enhanced warning for missing API key
             warning_row = status_box.row()
@@ -271,40 +538,44 @@ class AICodePreferences(bpy.types.AddonPreferences):
             warning_row.label(text="⚠️ API key required for AI functionality", icon='ERROR')
             
             # Provider-specific guidance
-            if self.ai_provider == 'openai':
-                status_box.label(text="→ Visit platform.openai.com to get your API key")
-            elif self.ai_provider == 'anthropic':
-                status_box.label(text="→ Visit console.anthropic.com to get your API key")
-            elif self.ai_provider == 'gemini':
-                status_box.label(text="→ Visit aistudio.google.com to get your API key")
+            status_box.label(text=PROVIDER_KEY_HINTS[provider])
             
+        # Tips and security notes are collapsed by default once a key is set, so the
+        # usual redraw skips them entirely
+        show_help = get_pref('show_setup_help')
+        layout.prop(self, "show_setup_help", icon='TRIA_DOWN' if show_help else 'TRIA_RIGHT', emboss=False)
+        if configured and not show_help:
+            return
+        
         # Quick setup tips
         tips_box = layout.box()
         tips_box.label(text="Quick Setup Tips:", icon='QUESTION')
-        if self.ai_provider == 'openai':
-            tips_box.label(text="• Get your API key from platform.openai.com")
-            tips_box.label(text="• GPT-4.1 offers the best capabilities for 3D modeling")
-            tips_box.label(text="• Create an account and navigate to API Keys section")
-        elif self.ai_provider == 'anthropic':
-            tips_box.label(text="• Get your API key from console.anthropic.com")
-            tips_box.label(text="• Claude 4 Opus excels at complex coding tasks")
-            tips_box.label(text="• Sign up and go to API Keys in your dashboard")
-        elif self.ai_provider == 'gemini':
-            tips_box.label(text="• Get your API key from aistudio.google.com")
-            tips_box.label(text="• Gemini 2.5 models support advanced reasoning")
-            tips_box.label(text="• Create a project and generate an API key")
-        elif self.ai_provider == 'local':
-            tips_box.label(text="• Ensure your local LLM server is running")
-            tips_box.label(text="• Test the URL in your browser first")
-            tips_box.label(text="• Common ports: 8080, 11434 (Ollama), 5000")
+        col = tips_box.column(align=True)
+        for tip in PROVIDER_TIPS[provider]:
+            col.label(text=tip)
             
         # Security information
         security_box = layout.box()
         security_box.label(text="🔒 Security & Privacy:", icon='LOCKED')
-        security_box.label(text="• API keys are stored locally in Blender preferences")
-        security_box.label(text="• Keys are not transmitted except to your chosen AI provider")
-        security_box.label(text="• For maximum security, use environment variables")
-        if self.ai_provider != 'local':
-            security_box.label(text="• Your code prompts are sent to the AI provider for processing")
-        else:
-            security_box.label(text="• Local models keep all data on your machine")
\ No newline at end of file
+        col = security_box.column(align=True)
+        for note in SECURITY_NOTES_LOCAL if provider == 'local' else SECURITY_NOTES_CLOUD:
+            col.label(text=note)
+
+def register():
+    bpy.utils.register_class(AICodePreferences)
+    # Loading factory preferences resets the values held in the cache; loading a file is
+    # another cheap point to re-read them
+    for handlers in (bpy.app.handlers.load_factory_preferences_post, bpy.app.handlers.load_post):
+        if _clear_preferences_cache not in handlers:
+            handlers.append(_clear_preferences_cache)
+    # Preferences can't be written safely while the add-on is still registering
+    bpy.app.timers.register(_restore_api_keys, first_interval=0.0)
+
+def unregister():
+    if bpy.app.timers.is_registered(_restore_api_keys):
+        bpy.app.timers.unregister(_restore_api_keys)
+    for handlers in (bpy.app.handlers.load_factory_preferences_post, bpy.app.handlers.load_post):
+        if _clear_preferences_cache in handlers:
+            handlers.remove(_clear_preferences_cache)
+    _clear_preferences_cache()
+    bpy.utils.unregister_class(AICodePreferences)
@@ -0,0 +1,57 @@
+"""Semantic cache gate: requests that differ only by a number or one word must not share a response.
+
+cache.py imports bpy, so these run where Blender's Python module is available.
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("bpy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import ResponseCache, embed_text  # noqa: E402
+
+THRESHOLD = 0.9
+
+
+@pytest.fixture
+def cache(tmp_path):
+    response_cache = ResponseCache(path=str(tmp_path / "cache.sqlite3"))
+    yield response_cache
+    response_cache.close()
+
+
+def store(cache, text):
+    scope = ResponseCache.make_scope("openai", "gpt-4.1", "SCENE")
+    cache.put_similar(scope, text, f"code for: {text}")
+    return scope
+
+
+def test_number_only_difference_misses(cache):
+    first = "move the selected cube up by 2 meters along the z axis"
+    second = "move the selected cube up by 5 meters along the z axis"
+    # The embedding alone would pass the gate; the word signature must reject it
+    assert float(embed_text(first) @ embed_text(second)) >= THRESHOLD
+    scope = store(cache, first)
+    assert cache.get_similar(scope, second, THRESHOLD) is None
+
+
+def test_one_word_difference_misses(cache):
+    scope = store(cache, "add a red metallic material to the selected cube")
+    assert cache.get_similar(scope, "add a blue metallic material to the selected cube", THRESHOLD) is None
+    assert cache.get_similar(scope, "add a red metallic material to the selected sphere", THRESHOLD) is None
+
+
+def test_case_and_punctuation_difference_hits(cache):
+    scope = store(cache, "add a red metallic material to the selected cube")
+    assert cache.get_similar(scope, "Add a red metallic material to the selected cube.", THRESHOLD) == (
+        "code for: add a red metallic material to the selected cube"
+    )
+
+
+def test_other_scope_misses(cache):
+    store(cache, "add a red metallic material to the selected cube")
+    other_scope = ResponseCache.make_scope("openai", "gpt-4.1", "OTHER SCENE")
+    assert cache.get_similar(other_scope, "add a red metallic material to the selected cube", THRESHOLD) is None